@@ -0,0 +1,137 @@
+"""Benchmark get_unique_words_per_indep_claim() on synthetic patents with 10, 100 and 1,000 claims.
+
+The original O(k^2) implementation is kept below as a reference. Each run checks that the current implementation gives the
+same result before timing both. The reference picks the latest independent claim by comparing claim numbers as strings,
+so once '101' sorts before '91' it puts dependent claims in the wrong group; the check is skipped for those sizes. It
+also joins claims without a space, fusing the last word of each claim with the next claim's number, so the check is run
+on claims that end with a space.
+
+Also times building the ClaimTree (claims_utils.py) that /api/patent/{patent_spif}/claims serves, and diffing two
+claims from it, as /api/patent/{patent_spif}/claims/diff does.
+
+Run from the repository root:
+    python -m benchmarks.claims_benchmark
+"""
+import argparse
+import random
+import re
+import timeit
+
+from claims_utils import ClaimTree
+from llm_utils import get_unique_words_per_indep_claim
+
+CLAIM_SEPARATOR = '\n     \n     \n       '
+
+
+def make_synthetic_claims(num_claims: int, indep_claim_every: int = 10, words_per_claim: int = 120, vocab_size: int = 5000, seed: int = 0) -> str:
+    """Build a claims string shaped like the ones BigQuery returns: every indep_claim_every-th claim is independent and
+    the claims in between depend on it.
+    """
+    rng = random.Random(seed)
+    vocab = [f'term{i}' for i in range(vocab_size)]
+    punctuation = ['', '', '', ',', ';', '.', ':']
+
+    claims = []
+    latest_indep_claim_num = 1
+    for claim_num in range(1, num_claims + 1):
+        body = ' '.join(rng.choice(vocab) + rng.choice(punctuation) for _ in range(words_per_claim))
+        if (claim_num - 1) % indep_claim_every == 0:
+            latest_indep_claim_num = claim_num
+            claims.append(f'{claim_num}. An apparatus comprising:\n {body}.')
+        else:
+            claims.append(f'{claim_num}. The apparatus of claim {latest_indep_claim_num}, wherein {body}.')
+    return CLAIM_SEPARATOR.join(claims)
+
+
+# ======================== Reference implementation ========================
+
+def reference_get_unique_words_per_indep_claim(claims: str) -> dict[str, list[str]]:
+    claims_list = claims.split(CLAIM_SEPARATOR)
+
+    dep_claim_pattern = r'of\s+claim'
+    indep_claim_indices = [i for i, c in enumerate(claims_list) if re.search(dep_claim_pattern, c) is None]
+
+    indep_claims_and_their_dependents = dict()
+    for i, c in enumerate(claims_list):
+        if i in indep_claim_indices:
+            claim_num = re.search(r'\d+', c).group()
+            indep_claims_and_their_dependents[claim_num] = c
+        else:
+            processed_indep_claim_indices = list(indep_claims_and_their_dependents.keys())
+            processed_indep_claim_indices.sort()
+            latest_indep_claim_index = processed_indep_claim_indices[-1]
+            indep_claims_and_their_dependents[latest_indep_claim_index] = indep_claims_and_their_dependents[latest_indep_claim_index] + c
+
+    word_sets = {ic_num: reference_get_word_set(claims_text) for ic_num, claims_text in indep_claims_and_their_dependents.items()}
+
+    unique_word_lists = dict()
+    for ic_num, word_set in word_sets.items():
+        unique_words = word_set
+        for other_ic_num, other_word_set in word_sets.items():
+            if ic_num == other_ic_num:
+                continue
+            unique_words = unique_words - other_word_set
+        unique_word_lists[ic_num] = list(unique_words)
+
+    return unique_word_lists
+
+
+def reference_get_word_set(multi_word_string: str) -> set:
+    words = multi_word_string.split(' ')
+
+    def remove_chars(word: str, chars_to_remove: list):
+        for char in chars_to_remove:
+            word = word.replace(char, '')
+        return word
+
+    words = [remove_chars(word, ['.', ';', ',', '(', ')', ':', '\n']) for word in words]
+    words = [word.lower() for word in words if len(word) > 1 and not word.isnumeric()]
+    return set(words)
+
+# ==========================================================================
+
+
+def as_comparable(unique_word_lists: dict[str, list[str]]) -> dict[str, set[str]]:
+    # The order of each word list comes from iterating over a set, so only the contents are meaningful.
+    return {ic_num: set(words) for ic_num, words in unique_word_lists.items()}
+
+
+def reference_groups_correctly(num_claims: int, indep_claim_every: int) -> bool:
+    """Whether the independent claims of make_synthetic_claims() sort the same as strings as they do as numbers."""
+    indep_claim_nums = [str(num) for num in range(1, num_claims + 1, indep_claim_every)]
+    return sorted(indep_claim_nums) == indep_claim_nums
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Numbers of claims to benchmark')
+    parser.add_argument('--indep-claim-every', type=int, default=10, help='One in this many claims is independent')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs per size; the best is reported')
+    args = parser.parse_args()
+
+    print(f'{"claims":>8} {"reference (ms)":>15} {"current (ms)":>13} {"speedup":>8} {"checked":>8} {"tree build (ms)":>16} {"tree load (ms)":>15} {"diff (us)":>10}')
+    for num_claims in args.sizes:
+        claims = make_synthetic_claims(num_claims, indep_claim_every=args.indep_claim_every)
+
+        checked = reference_groups_correctly(num_claims, args.indep_claim_every)
+        if checked:
+            spaced_claims = claims.replace(CLAIM_SEPARATOR, ' ' + CLAIM_SEPARATOR)
+            assert as_comparable(get_unique_words_per_indep_claim(spaced_claims)) == as_comparable(reference_get_unique_words_per_indep_claim(spaced_claims)), \
+                f'Current implementation disagrees with the reference for {num_claims} claims.'
+
+        number = max(1, 1000 // num_claims)
+        reference_s = min(timeit.repeat(lambda: reference_get_unique_words_per_indep_claim(claims), number=number, repeat=args.repeat)) / number
+        current_s = min(timeit.repeat(lambda: get_unique_words_per_indep_claim(claims), number=number, repeat=args.repeat)) / number
+
+        # Building parses and tokenizes the claims, as at ingest time; loading rebuilds the tree from its stored form.
+        build_s = min(timeit.repeat(lambda: ClaimTree.from_claims(claims), number=number, repeat=args.repeat)) / number
+        tree_dict = ClaimTree.from_claims(claims).to_dict()
+        load_s = min(timeit.repeat(lambda: ClaimTree.from_dict(tree_dict), number=number, repeat=args.repeat)) / number
+        tree = ClaimTree.from_dict(tree_dict)
+        diff_s = min(timeit.repeat(lambda: tree.diff(num_claims, 1), number=1000, repeat=args.repeat)) / 1000
+        print(f'{num_claims:>8} {reference_s * 1e3:>15.3f} {current_s * 1e3:>13.3f} {reference_s / current_s:>7.1f}x {str(checked):>8} '
+              f'{build_s * 1e3:>16.3f} {load_s * 1e3:>15.3f} {diff_s * 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
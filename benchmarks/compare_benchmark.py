@@ -0,0 +1,64 @@
+"""Benchmark /api/ai/compare for growing numbers of patents, with the per-patent sub-questions sent one at a time
+(--concurrency 1 reproduces the sequential SubQuestionQueryEngine prototype) and concurrently.
+
+MongoDB, BigQuery and OpenAI are replaced by the stand-ins in benchmarks/fakes.py, with every LLM call taking
+--llm-latency seconds, so a concurrent comparison should take about two LLM calls (one sub-question and the combining
+call) however many patents it covers.
+
+Run from the repository root:
+    python -m benchmarks.compare_benchmark --patent-counts 2 4 8 --concurrency 1 4 8
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import llm_utils
+import main as api
+from benchmarks.fakes import FakeLatencies, install_fakes
+from llm_utils import get_tokenizer
+
+
+async def run(args: argparse.Namespace) -> None:
+    with install_fakes(FakeLatencies(db=args.db_latency, llm=args.llm_latency)):
+        await api.ensure_indexes()
+        get_tokenizer()
+        user_id = f'{1:024x}'
+
+        print(f'{"patents":>8} {"concurrency":>12} {"time (ms)":>10} {"LLM calls":>10}')
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url='http://benchmark', timeout=None) as client:
+            for num_patents in args.patent_counts:
+                project = (await client.post('/api/project/', json={
+                    'name': f'Compare {num_patents}', 'chat': {user_id: []}, 'patents': {user_id: []}, 'user_ids': [user_id], 'document_ids': []})).json()
+                numbers = [f'{2000000 + i}B2' for i in range(num_patents)]
+                for number in numbers:
+                    await client.post(f'/api/patent/US{number}', params={'wait': api.JOB_MAX_WAIT_SECONDS})
+                await client.post(f'/api/project/{project["mongo_id"]}/patents/{user_id}', json={
+                    'patents': [{'office': 'US', 'number': number} for number in numbers]})
+
+                for concurrency in args.concurrency:
+                    llm_utils.compare_max_concurrency = concurrency
+                    start = time.perf_counter()
+                    response = await client.get('/api/ai/compare', params={
+                        'project_id': project['mongo_id'], 'user_id': user_id, 'use_cache': False,
+                        'question': 'How do the independent claims of these patents differ from each other?'})
+                    elapsed = time.perf_counter() - start
+                    response.raise_for_status()
+                    print(f'{num_patents:>8} {concurrency:>12} {elapsed * 1e3:>10.0f} {elapsed / args.llm_latency:>10.1f}')
+        api.ingest_jobs.shutdown()
+        llm_utils.compare_max_concurrency = llm_utils.COMPARE_MAX_CONCURRENCY
+    print(f'LLM calls: the time in units of --llm-latency ({args.llm_latency * 1e3:g} ms)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patent-counts', type=int, nargs='+', default=[2, 4, 8], help='Numbers of patents compared')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8], help='Values of compare_max_concurrency to try')
+    parser.add_argument('--db-latency', type=float, default=0.002, help='Seconds per MongoDB operation')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per LLM response')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,525 @@
+"""Local stand-ins for MongoDB, BigQuery and OpenAI, so that the API can be benchmarked without credentials or network.
+
+Each stand-in waits a configurable time per call to mimic the real service's latency: the MongoDB stand-in and the
+LLM with asyncio.sleep(), like the real async clients, and the BigQuery client with time.sleep(), since the real one
+blocks the thread it runs on.
+
+    with install_fakes(FakeLatencies(db=0.002, bq=0.5, llm=1.0)):
+        ...  # Drive main.app, e.g. with httpx.AsyncClient(app=main.app).
+"""
+import asyncio
+import copy
+import random
+import re
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterator
+from unittest import mock
+
+from bson.objectid import ObjectId
+from langchain.schema import AIMessage, ChatGeneration, LLMResult
+from langchain.schema.messages import AIMessageChunk
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import big_query_utils
+import database
+import llm_utils
+from benchmarks.claims_benchmark import make_synthetic_claims
+
+
+@dataclass
+class FakeLatencies:
+    """Seconds each call to a stand-in takes."""
+    db: float = 0.0
+    bq: float = 0.0
+    llm: float = 0.0
+    # Seconds between the tokens of a streamed LLM response.
+    llm_token: float = 0.0
+
+
+# ======================== MongoDB ========================
+
+_MISSING = object()
+
+
+def _get_field(document: dict, dotted_key: str) -> Any:
+    value = document
+    for key in dotted_key.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return value
+
+
+def _set_field(document: dict, dotted_key: str, value: Any) -> None:
+    *parents, last = dotted_key.split('.')
+    for key in parents:
+        document = document.setdefault(key, dict())
+    document[last] = value
+
+
+def _matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        value = _get_field(document, key)
+        if isinstance(condition, dict) and '$in' in condition:
+            if value is _MISSING or value not in condition['$in']:
+                return False
+        elif value is _MISSING or value != condition:
+            return False
+    return True
+
+
+def _project(document: dict, projection: dict | None) -> dict:
+    if not projection:
+        return copy.deepcopy(document)
+
+    include_id = projection.get('_id', 1)
+    fields = {key: value for key, value in projection.items() if key != '_id'}
+    if fields and all(fields.values()):
+        projected = dict()
+        for key in fields:
+            value = _get_field(document, key)
+            if value is not _MISSING:
+                _set_field(projected, key, copy.deepcopy(value))
+    else:
+        projected = copy.deepcopy(document)
+        for key in fields:
+            *parents, last = key.split('.')
+            parent = _get_field(projected, '.'.join(parents)) if parents else projected
+            if isinstance(parent, dict):
+                parent.pop(last, None)
+
+    if include_id and '_id' in document:
+        projected['_id'] = document['_id']
+    else:
+        projected.pop('_id', None)
+    return projected
+
+
+def _apply_update(document: dict, update: dict) -> None:
+    for key, value in update.get('$set', dict()).items():
+        _set_field(document, key, copy.deepcopy(value))
+    for key in update.get('$unset', dict()):
+        *parents, last = key.split('.')
+        parent = _get_field(document, '.'.join(parents)) if parents else document
+        if isinstance(parent, dict):
+            parent.pop(last, None)
+    for key, value in update.get('$inc', dict()).items():
+        current = _get_field(document, key)
+        _set_field(document, key, value if current is _MISSING else current + value)
+    for key, value in update.get('$push', dict()).items():
+        values = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+        current = _get_field(document, key)
+        if current is _MISSING:
+            _set_field(document, key, copy.deepcopy(values))
+        else:
+            current.extend(copy.deepcopy(values))
+    for key, value in update.get('$addToSet', dict()).items():
+        values = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+        current = _get_field(document, key)
+        if current is _MISSING:
+            current = []
+            _set_field(document, key, current)
+        current.extend(copy.deepcopy(v) for v in values if v not in current)
+    for key, value in update.get('$pull', dict()).items():
+        current = _get_field(document, key)
+        if current is not _MISSING:
+            values = value['$in'] if isinstance(value, dict) and '$in' in value else [value]
+            current[:] = [v for v in current if v not in values]
+
+
+def _text_score(document: dict, search: str, weights: dict[str, int]) -> float:
+    """Rough stand-in for MongoDB's textScore: weighted occurrences of the search words in the text indexed fields,
+    without MongoDB's stemming, stop words or phrase and negation syntax.
+    """
+    search_words = set(re.findall(r'\w+', search.lower()))
+    score = 0.0
+    for field, weight in weights.items():
+        value = _get_field(document, field)
+        if isinstance(value, str):
+            words = re.findall(r'\w+', value.lower())
+            score += weight * sum(word in search_words for word in words) / max(len(words), 1)
+    return score
+
+
+def _evaluate(document: dict, expression: Any) -> Any:
+    """Evaluate the subset of MongoDB's aggregation expressions that database.py uses: field paths like '$chat.<user_id>',
+    literals, and the operators in _OPERATORS.
+    """
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = _get_field(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict) and len(expression) == 1 and next(iter(expression)) in _OPERATORS:
+        name, arguments = next(iter(expression.items()))
+        arguments = arguments if isinstance(arguments, list) else [arguments]
+        return _OPERATORS[name](*(_evaluate(document, argument) for argument in arguments))
+    return expression
+
+
+_OPERATORS = {
+    '$ifNull': lambda value, replacement: replacement if value is None else value,
+    '$size': len,
+    '$min': min,
+    '$max': max,
+    '$subtract': lambda a, b: a - b,
+    '$gt': lambda a, b: a > b,
+    '$cond': lambda condition, if_true, if_false: if_true if condition else if_false,
+    '$slice': lambda values, position, count: values[position:position + count],
+}
+
+
+def _project_stage(document: dict, projection: dict) -> dict:
+    """A $project stage whose fields are either included with 1, or computed from an expression."""
+    projected = dict()
+    if projection.get('_id', 1) and '_id' in document:
+        projected['_id'] = document['_id']
+    for key, expression in projection.items():
+        if key == '_id':
+            continue
+        if expression in (1, True):
+            value = _get_field(document, key)
+            if value is not _MISSING:
+                _set_field(projected, key, copy.deepcopy(value))
+        else:
+            _set_field(projected, key, copy.deepcopy(_evaluate(document, expression)))
+    return projected
+
+
+class FakeCursor:
+    def __init__(self, documents: list[dict]):
+        self._documents = documents
+
+    def sort(self, keys: list[tuple[str, Any]]) -> 'FakeCursor':
+        # Python's sort is stable, so sorting by the last key first leaves the documents ordered by all of them.
+        for key, direction in reversed(keys):
+            # Text scores sort best first, like MongoDB's {'$meta': 'textScore'}.
+            reverse = isinstance(direction, dict) or direction < 0
+            self._documents.sort(key=lambda document: _get_field(document, key), reverse=reverse)
+        return self
+
+    def skip(self, count: int) -> 'FakeCursor':
+        self._documents = self._documents[count:]
+        return self
+
+    def limit(self, count: int) -> 'FakeCursor':
+        self._documents = self._documents[:count] if count else self._documents
+        return self
+
+    def __aiter__(self) -> AsyncIterator[dict]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[dict]:
+        for document in self._documents:
+            yield document
+
+    async def to_list(self, length: int | None = None) -> list[dict]:
+        return self._documents[:length]
+
+
+class FakeResult:
+    def __init__(self, upserted_count: int = 0):
+        self.upserted_count = upserted_count
+
+
+class FakeCollection:
+    """The subset of AsyncIOMotorCollection that database.py uses, holding documents in a list. Unique indexes are enforced."""
+
+    def __init__(self, name: str, latencies: FakeLatencies):
+        self.name = name
+        self.latencies = latencies
+        self.documents: list[dict] = []
+        self.unique_keys: list[tuple[str, ...]] = []
+        # Weights of the fields in the collection's text index, if it has one.
+        self.text_weights: dict[str, int] = dict()
+        self.num_ops = 0
+
+    async def _round_trip(self) -> None:
+        self.num_ops += 1
+        if self.latencies.db:
+            await asyncio.sleep(self.latencies.db)
+
+    def _find(self, query: dict) -> dict | None:
+        return next((document for document in self.documents if _matches(document, query)), None)
+
+    def _check_unique(self, document: dict, ignore: dict | None = None) -> None:
+        for keys in self.unique_keys:
+            values = [_get_field(document, key) for key in keys]
+            for other in self.documents:
+                if other is not ignore and [_get_field(other, key) for key in keys] == values:
+                    raise DuplicateKeyError('E11000 duplicate key error', 11000, {'keyValue': dict(zip(keys, values))})
+
+    def _insert(self, document: dict) -> None:
+        document.setdefault('_id', ObjectId())
+        self._check_unique(document)
+        self.documents.append(copy.deepcopy(document))
+
+    async def create_index(self, keys: list[tuple[str, int]], unique: bool = False, **kwargs) -> None:
+        await self._round_trip()
+        if unique:
+            self.unique_keys.append(tuple(key for key, _ in keys))
+        text_keys = [key for key, direction in keys if direction == 'text']
+        if text_keys:
+            self.text_weights = {key: kwargs.get('weights', dict()).get(key, 1) for key in text_keys}
+
+    async def find_one(self, query: dict, projection: dict | None = None) -> dict | None:
+        await self._round_trip()
+        document = self._find(query)
+        return None if document is None else _project(document, projection)
+
+    def find(self, query: dict, projection: dict | None = None) -> FakeCursor:
+        # Motor's find() only sends the query when the cursor is first iterated, so there is no latency to add here.
+        self.num_ops += 1
+        if '$text' not in query:
+            return FakeCursor([_project(document, projection) for document in self.documents if _matches(document, query)])
+
+        query = dict(query)
+        search = query.pop('$text')['$search']
+        meta_fields = [key for key, value in (projection or dict()).items() if isinstance(value, dict)]
+        projection = {key: value for key, value in (projection or dict()).items() if key not in meta_fields}
+        documents = []
+        for document in self.documents:
+            score = _text_score(document, search, self.text_weights)
+            if score and _matches(document, query):
+                projected = _project(document, projection)
+                projected.update((key, score) for key in meta_fields)
+                documents.append(projected)
+        return FakeCursor(documents)
+
+    def aggregate(self, pipeline: list[dict]) -> FakeCursor:
+        """Runs pipelines of $match and $project stages (see _project_stage())."""
+        # Like find(), the pipeline is only sent when the cursor is first iterated.
+        self.num_ops += 1
+        documents = self.documents
+        for stage in pipeline:
+            (name, argument), = stage.items()
+            if name == '$match':
+                documents = [document for document in documents if _matches(document, argument)]
+            elif name == '$project':
+                documents = [_project_stage(document, argument) for document in documents]
+            else:
+                raise NotImplementedError(f'FakeCollection.aggregate() does not support {name}')
+        return FakeCursor(documents)
+
+    async def insert_one(self, document: dict) -> None:
+        await self._round_trip()
+        self._insert(document)
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True) -> None:
+        await self._round_trip()
+        write_errors = []
+        for index, document in enumerate(documents):
+            try:
+                self._insert(document)
+            except DuplicateKeyError:
+                write_errors.append({'index': index, 'code': database.DUPLICATE_KEY_ERROR_CODE})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors})
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False) -> FakeResult:
+        await self._round_trip()
+        return self._update(query, update, upsert)
+
+    def _update(self, query: dict, update: dict, upsert: bool) -> FakeResult:
+        document = self._find(query)
+        if document is None:
+            if not upsert:
+                return FakeResult()
+            document = copy.deepcopy(query)
+            _apply_update(document, update)
+            self._insert(document)
+            return FakeResult(upserted_count=1)
+        _apply_update(document, update)
+        return FakeResult()
+
+    async def replace_one(self, query: dict, replacement: dict, upsert: bool = False) -> FakeResult:
+        await self._round_trip()
+        return self._replace(query, replacement, upsert)
+
+    def _replace(self, query: dict, replacement: dict, upsert: bool) -> FakeResult:
+        document = self._find(query)
+        if document is None:
+            if upsert:
+                self._insert(copy.deepcopy(replacement))
+                return FakeResult(upserted_count=1)
+            return FakeResult()
+        _id = document['_id']
+        document.clear()
+        document.update(copy.deepcopy(replacement), _id=_id)
+        return FakeResult()
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: dict | None = None, return_document: bool = False) -> dict | None:
+        await self._round_trip()
+        document = self._find(query)
+        if document is None:
+            return None
+        before = _project(document, projection)
+        _apply_update(document, update)
+        return _project(document, projection) if return_document else before
+
+    async def bulk_write(self, operations: list, ordered: bool = True) -> FakeResult:
+        await self._round_trip()
+        upserted_count = 0
+        for operation in operations:
+            # pymongo's operation classes keep their arguments in these attributes.
+            if '$' in next(iter(operation._doc), ''):
+                upserted_count += self._update(operation._filter, operation._doc, operation._upsert).upserted_count
+            else:
+                upserted_count += self._replace(operation._filter, operation._doc, operation._upsert).upserted_count
+        return FakeResult(upserted_count)
+
+
+class FakeDatabase:
+    def __init__(self, latencies: FakeLatencies):
+        self._latencies = latencies
+        self._collections: dict[str, FakeCollection] = dict()
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, FakeCollection(name, self._latencies))
+
+    def num_ops(self) -> int:
+        return sum(collection.num_ops for collection in self._collections.values())
+
+
+class FakeAdmin:
+    def __init__(self, latencies: FakeLatencies):
+        self._latencies = latencies
+
+    async def command(self, name: str) -> dict:
+        await asyncio.sleep(self._latencies.db)
+        return {'ok': 1}
+
+
+class FakeMotorClient:
+    """Stands in for AsyncIOMotorClient. Every database name gives the same in-memory database."""
+
+    def __init__(self, latencies: FakeLatencies):
+        self.admin = FakeAdmin(latencies)
+        self.law = FakeDatabase(latencies)
+
+    def close(self) -> None:
+        pass
+
+
+# ======================== BigQuery ========================
+
+def make_synthetic_patent(patent_spif: str, num_claims: int = 20, description_words: int = 2000) -> dict:
+    """A patent shaped like the ones BigQuery returns, with text made up from patent_spif as a seed."""
+    rng = random.Random(patent_spif)
+    vocab = [f'term{i}' for i in range(5000)]
+    return {
+        'spif': patent_spif,
+        'title': ' '.join(rng.choice(vocab) for _ in range(8)),
+        'abstract': ' '.join(rng.choice(vocab) for _ in range(150)),
+        'claims': make_synthetic_claims(num_claims, seed=rng.randrange(1 << 30)),
+        'description': ' '.join(rng.choice(vocab) for _ in range(description_words)),
+    }
+
+
+class FakeRow:
+    def __init__(self, fields: dict):
+        self.__dict__.update(fields)
+
+
+class FakeQueryJob:
+    def __init__(self, rows: list[FakeRow], latency: float):
+        self._rows = rows
+        self._latency = latency
+
+    def result(self) -> list[FakeRow]:
+        # The real client blocks while waiting for the query, so this does too.
+        time.sleep(self._latency)
+        return self._rows
+
+
+class FakeBigQueryClient:
+    """Stands in for bigquery.Client, answering big_query_utils' queries with synthetic patents for any SPIF. SPIFs
+    starting with "MISSING" are not found.
+    """
+
+    def __init__(self, latencies: FakeLatencies):
+        self.latencies = latencies
+        self.num_queries = 0
+
+    def query(self, query: str, job_config) -> FakeQueryJob:
+        self.num_queries += 1
+        parameters = {parameter.name: parameter for parameter in job_config.query_parameters}
+        if query == big_query_utils.DESCRIPTION_QUERY:
+            spifs = [parameters['spif'].value]
+            fields = ('spif', 'description')
+        else:
+            spifs = parameters['spifs'].values
+            fields = ('spif', 'title', 'abstract', 'claims')
+
+        rows = []
+        for spif in spifs:
+            if not spif.startswith('MISSING'):
+                patent = make_synthetic_patent(spif)
+                rows.append(FakeRow({field: patent[field] for field in fields}))
+        return FakeQueryJob(rows, self.latencies.bq)
+
+
+# ======================== OpenAI ========================
+
+class FakeChatModel:
+    """Stands in for ChatOpenAI, answering every prompt with a canned response made from the last message."""
+
+    def __init__(self, latencies: FakeLatencies, model_name: str = llm_utils.PROMPT_MODEL_NAME, temperature: float = 0.7,
+                 max_tokens: int | None = None, **kwargs):
+        self.latencies = latencies
+        self.model_name = model_name
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.n = 1
+        self.model_kwargs = dict()
+
+    @staticmethod
+    def _respond(messages: list) -> str:
+        return f'The patents answer {len(messages[-1].content.split())} words of question in "claim 1".'
+
+    def generate(self, messages_list: list[list]) -> LLMResult:
+        time.sleep(self.latencies.llm)
+        return LLMResult(generations=[[ChatGeneration(message=AIMessage(content=self._respond(messages)))] for messages in messages_list])
+
+    async def agenerate(self, messages_list: list[list]) -> LLMResult:
+        await asyncio.sleep(self.latencies.llm)
+        return LLMResult(generations=[[ChatGeneration(message=AIMessage(content=self._respond(messages)))] for messages in messages_list])
+
+    async def astream(self, messages: list) -> AsyncIterator[AIMessageChunk]:
+        await asyncio.sleep(self.latencies.llm)
+        for word in self._respond(messages).split(' '):
+            await asyncio.sleep(self.latencies.llm_token)
+            yield AIMessageChunk(content=word + ' ')
+
+
+@dataclass
+class Fakes:
+    """Handles on the installed stand-ins, e.g. to read their operation counters."""
+    latencies: FakeLatencies
+    mongo_client: FakeMotorClient
+    bq_client: FakeBigQueryClient
+
+
+@contextmanager
+def install_fakes(latencies: FakeLatencies) -> Iterator[Fakes]:
+    """Connect database.py to an in-memory MongoDB stand-in, and point big_query_utils and llm_utils at stand-ins for
+    BigQuery and OpenAI, until the with block exits. The response cache of llm_utils is cleared on the way in and out.
+    """
+    mongo_client = FakeMotorClient(latencies)
+    bq_client = FakeBigQueryClient(latencies)
+    with mock.patch('motor.motor_asyncio.AsyncIOMotorClient', lambda *args, **kwargs: mongo_client), \
+            mock.patch.object(big_query_utils, 'get_client', lambda: bq_client), \
+            mock.patch.object(llm_utils, 'make_chat_model', lambda **kwargs: FakeChatModel(latencies, **kwargs)):
+        database.connect_to_db({'mongodb_user': 'benchmark', 'mongodb_pw': 'benchmark'})
+        llm_utils.ai_response_cache.clear()
+        try:
+            yield Fakes(latencies, mongo_client, bq_client)
+        finally:
+            database.close_db()
+            database.patent_cache.clear()
+            llm_utils.ai_response_cache.clear()
+            llm_utils.patent_index_cache.clear()
@@ -0,0 +1,125 @@
+"""Load test the API end to end, with MongoDB, BigQuery and OpenAI replaced by the local stand-ins in benchmarks/fakes.py.
+
+Each simulated lawyer creates a user and a project, adds patents to the project (fetching them through
+/api/patent/{spif}), asks questions through /api/ai and then reads the chat back a page at a time through
+/api/project/{project_id}/chat/{user_id}. Lawyers are simulated --concurrency at a time, with
+requests sent straight to the ASGI app, so the numbers measure the app itself rather than a network or server.
+Latency percentiles are reported per endpoint, along with throughput over the whole run.
+
+Run from the repository root:
+    python -m benchmarks.load_benchmark --users 200 --concurrency 20 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+import httpx
+
+import main as api
+from benchmarks.fakes import FakeLatencies, install_fakes
+from llm_utils import get_tokenizer
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))]
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request, recording its latency under name, and count it as an error unless it succeeded."""
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[name].append(time.perf_counter() - start)
+        if not response.is_success:
+            self.errors[name] += 1
+        return response
+
+
+async def simulate_lawyer(client: httpx.AsyncClient, recorder: LatencyRecorder, lawyer_num: int, args: argparse.Namespace) -> None:
+    user = (await recorder.request(client, 'POST /api/user', 'POST', '/api/user', json={
+        'first_name': 'Bench', 'last_name': f'Lawyer{lawyer_num}', 'email_address': f'lawyer{lawyer_num}@example.com', 'project_ids': []})).json()
+    user_id = user['mongo_id']
+    project = (await recorder.request(client, 'POST /api/project', 'POST', '/api/project/', json={
+        'name': f'Project {lawyer_num}', 'chat': {user_id: []}, 'patents': {user_id: []}, 'user_ids': [user_id], 'document_ids': []})).json()
+    project_id = project['mongo_id']
+
+    # Lawyers pick patents from a shared pool, so that popular patents are fetched from BigQuery once and then found in the DB.
+    patent_numbers = [f'{1000000 + (lawyer_num * 7 + i * 13) % args.patent_pool}B2' for i in range(args.patents_per_user)]
+    for number in patent_numbers:
+        await recorder.request(client, 'POST /api/patent', 'POST', f'/api/patent/US{number}', params={'wait': api.JOB_MAX_WAIT_SECONDS})
+    await recorder.request(client, 'PUT /api/project', 'PUT', f'/api/project/{project_id}', params={'user_id': user_id}, json={
+        'patents': {user_id: [{'office': 'US', 'number': number} for number in patent_numbers]}})
+
+    for turn in range(args.turns):
+        await recorder.request(client, 'GET /api/ai', 'GET', '/api/ai', params={
+            'project_id': project_id, 'user_id': user_id, 'use_cache': not args.no_llm_cache,
+            'last_user_chat_msg': f'How does claim {turn + 1} of US{patent_numbers[0]} differ from the prior art in question {turn}?'})
+
+    # Page back through the chat like the frontend does when the project is reopened, two turns per page.
+    params = {'limit': 4}
+    while True:
+        page = (await recorder.request(client, 'GET /api/project/chat', 'GET', f'/api/project/{project_id}/chat/{user_id}', params=params)).json()
+        if page['next_before'] is None:
+            break
+        params['before'] = page['next_before']
+
+
+async def run_load(args: argparse.Namespace) -> None:
+    latencies = FakeLatencies(db=args.db_latency, bq=args.bq_latency, llm=args.llm_latency)
+    with install_fakes(latencies) as fakes:
+        # As in main.lifespan(): make the indexes and load the tokenizer before any request.
+        await api.ensure_indexes()
+        get_tokenizer()
+
+        recorder = LatencyRecorder()
+        lawyer_nums = asyncio.Queue()
+        for lawyer_num in range(args.users):
+            lawyer_nums.put_nowait(lawyer_num)
+
+        async def worker(client: httpx.AsyncClient) -> None:
+            while not lawyer_nums.empty():
+                await simulate_lawyer(client, recorder, lawyer_nums.get_nowait(), args)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url='http://benchmark', timeout=None) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*[worker(client) for _ in range(args.concurrency)])
+            elapsed = time.perf_counter() - start
+        api.ingest_jobs.shutdown()
+
+        print(f'{args.users} lawyers, {args.concurrency} at a time, in {elapsed:.2f} s '
+              f'(latencies: db {args.db_latency * 1e3:g} ms, BigQuery {args.bq_latency * 1e3:g} ms, LLM {args.llm_latency * 1e3:g} ms)')
+        print(f'{"endpoint":<22} {"requests":>8} {"errors":>6} {"p50 (ms)":>9} {"p95 (ms)":>9} {"p99 (ms)":>9} {"req/s":>8}')
+        all_latencies = []
+        for name, values in recorder.latencies.items():
+            values.sort()
+            all_latencies.extend(values)
+            print(f'{name:<22} {len(values):>8} {recorder.errors[name]:>6} {percentile(values, 0.5) * 1e3:>9.1f} '
+                  f'{percentile(values, 0.95) * 1e3:>9.1f} {percentile(values, 0.99) * 1e3:>9.1f} {len(values) / elapsed:>8.1f}')
+        all_latencies.sort()
+        print(f'{"all":<22} {len(all_latencies):>8} {sum(recorder.errors.values()):>6} {percentile(all_latencies, 0.5) * 1e3:>9.1f} '
+              f'{percentile(all_latencies, 0.95) * 1e3:>9.1f} {percentile(all_latencies, 0.99) * 1e3:>9.1f} {len(all_latencies) / elapsed:>8.1f}')
+        print(f'MongoDB operations: {fakes.mongo_client.law.num_ops()}, BigQuery queries: {fakes.bq_client.num_queries}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='Number of simulated lawyers')
+    parser.add_argument('--concurrency', type=int, default=10, help='Lawyers simulated at once')
+    parser.add_argument('--patents-per-user', type=int, default=2, help='Patents each lawyer adds to their project')
+    parser.add_argument('--patent-pool', type=int, default=50, help='Number of distinct patents the lawyers pick from')
+    parser.add_argument('--turns', type=int, default=5, help='Questions each lawyer asks')
+    parser.add_argument('--db-latency', type=float, default=0.002, help='Seconds per MongoDB operation')
+    parser.add_argument('--bq-latency', type=float, default=0.5, help='Seconds per BigQuery query')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per LLM response')
+    parser.add_argument('--no-llm-cache', action='store_true', help='Bypass the AI response cache')
+    asyncio.run(run_load(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
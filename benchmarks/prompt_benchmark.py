@@ -0,0 +1,51 @@
+"""Benchmark construct_ai_prompt() on synthetic projects with growing chats and numbers of patents.
+
+Patent retrieval indices are built beforehand, as they are at ingest time, so the timings cover what /api/ai does on
+every turn: ranking chunks, counting tokens and fitting the chat and patents into the token budget.
+See benchmarks/claims_benchmark.py for get_unique_words_per_indep_claim().
+
+Run from the repository root:
+    python -m benchmarks.prompt_benchmark
+"""
+import argparse
+import timeit
+
+from benchmarks.fakes import make_synthetic_patent
+from llm_utils import analyze_claims, build_patent_index, construct_ai_prompt, get_tokenizer
+from retrieval_utils import ChunkIndex
+
+
+def make_synthetic_chat(num_msgs: int, words_per_msg: int = 60) -> list[dict[str, str]]:
+    """A chat alternating between the lawyer and the AI, ending with the lawyer's question."""
+    chat = []
+    for msg_num in range(num_msgs):
+        source = 'user' if (num_msgs - msg_num) % 2 == 1 else 'ai'
+        chat.append({'source': source, 'msg': ' '.join(f'term{(msg_num * 31 + i) % 5000}' for i in range(words_per_msg))})
+    return chat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chat-sizes', type=int, nargs='+', default=[1, 10, 100, 1000], help='Numbers of chat messages to benchmark')
+    parser.add_argument('--patent-counts', type=int, nargs='+', default=[1, 5], help='Numbers of patents in the project')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs per case; the best is reported')
+    args = parser.parse_args()
+
+    get_tokenizer()
+    print(f'{"patents":>8} {"messages":>9} {"time (ms)":>10} {"prompt tokens":>14} {"msgs omitted":>13}')
+    for num_patents in args.patent_counts:
+        patents = [make_synthetic_patent(f'US{1000000 + i}B2') for i in range(num_patents)]
+        for patent in patents:
+            patent['claim_analysis'] = analyze_claims(patent['claims'])
+        indices = [ChunkIndex.from_dict(build_patent_index(patent)) for patent in patents]
+
+        for num_msgs in args.chat_sizes:
+            chat = make_synthetic_chat(num_msgs)
+            _, report = construct_ai_prompt(chat, patents, patent_indices=indices)
+            number = max(1, 100 // num_msgs)
+            seconds = min(timeit.repeat(lambda: construct_ai_prompt(chat, patents, patent_indices=indices), number=number, repeat=args.repeat)) / number
+            print(f'{num_patents:>8} {num_msgs:>9} {seconds * 1e3:>10.3f} {report["prompt_tokens"]:>14} {report["chat_messages_omitted"]:>13}')
+
+
+if __name__ == '__main__':
+    main()
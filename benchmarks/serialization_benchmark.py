@@ -0,0 +1,99 @@
+"""Benchmark GET /api/project/{project_id} on projects with large chats, with project documents encoded directly by
+main.document_response() against validating them with pydantic first (validate_db_responses in config.yaml).
+
+Two timings are reported for each chat size:
+- encode: turning the project document into response bytes, as FastAPI does for the endpoint's response_model
+  (pydantic validation, jsonable_encoder and the json module) or as document_response() does (orjson).
+- request: the whole request sent straight to the ASGI app, with MongoDB replaced by the in-memory stand-in in
+  benchmarks/fakes.py, reported as median latency and CPU time per request.
+
+Run from the repository root:
+    python -m benchmarks.serialization_benchmark --chat-sizes 100 1000 10000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+import main as api
+from benchmarks.fakes import FakeLatencies, install_fakes
+from benchmarks.prompt_benchmark import make_synthetic_chat
+from models import ProjectDataToClient
+
+NUM_USERS = 4
+
+
+def make_synthetic_project(num_msgs: int, user_ids: list[str]) -> dict:
+    """A project whose users' chats hold num_msgs messages in total, as sent to POST /api/project."""
+    return {
+        'name': f'Project with {num_msgs} messages',
+        'chat': {user_id: make_synthetic_chat(num_msgs // len(user_ids)) for user_id in user_ids},
+        'patents': {user_id: [{'office': 'US', 'number': f'{1000000 + i}B2'} for i in range(5)] for user_id in user_ids},
+        'user_ids': user_ids,
+        'document_ids': [],
+    }
+
+
+async def time_encoding(document: dict, repeat: int) -> tuple[float, float, int]:
+    """Best seconds to encode document into response bytes with and without validation, and the size of the response."""
+    route = next(route for route in api.app.routes if getattr(route, 'endpoint', None) is api.get_project_by_id)
+    validated_times, direct_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = await serialize_response(field=route.response_field, response_content=api.reformat_mongodb_id_field(dict(document)))
+        validated_body = JSONResponse(content).body
+        validated_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        direct_body = api.document_response(dict(document), ProjectDataToClient).body
+        direct_times.append(time.perf_counter() - start)
+    return min(validated_times), min(direct_times), len(direct_body)
+
+
+async def time_requests(client: httpx.AsyncClient, project_id: str, validate: bool, repeat: int) -> tuple[float, float]:
+    """Median latency and mean CPU time, in seconds, of GET /api/project/{project_id}."""
+    api.validate_db_responses = validate
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(f'/api/project/{project_id}')
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return statistics.median(latencies), (time.process_time() - cpu_start) / repeat
+
+
+async def run(args: argparse.Namespace) -> None:
+    with install_fakes(FakeLatencies(db=args.db_latency)) as fakes:
+        await api.ensure_indexes()
+        user_ids = [f'{user_num:024x}' for user_num in range(NUM_USERS)]
+
+        print(f'{"messages":>9} {"size (KB)":>10} | {"encode (ms)":>23} | {"request p50 (ms)":>23} | {"request CPU (ms)":>23}')
+        print(f'{"":>9} {"":>10} | {"validated":>11} {"direct":>11} | {"validated":>11} {"direct":>11} | {"validated":>11} {"direct":>11}')
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url='http://benchmark', timeout=None) as client:
+            for num_msgs in args.chat_sizes:
+                project = (await client.post('/api/project/', json=make_synthetic_project(num_msgs, user_ids))).json()
+                document = await fakes.mongo_client.law.projects.find_one({'name': project['name']})
+
+                encode_validated, encode_direct, size = await time_encoding(document, args.repeat)
+                request_validated, cpu_validated = await time_requests(client, project['mongo_id'], True, args.repeat)
+                request_direct, cpu_direct = await time_requests(client, project['mongo_id'], False, args.repeat)
+                print(f'{num_msgs:>9} {size / 1024:>10.0f} | {encode_validated * 1e3:>11.2f} {encode_direct * 1e3:>11.2f} | '
+                      f'{request_validated * 1e3:>11.2f} {request_direct * 1e3:>11.2f} | {cpu_validated * 1e3:>11.2f} {cpu_direct * 1e3:>11.2f}')
+        api.validate_db_responses = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chat-sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Chat messages in each project, split between its users')
+    parser.add_argument('--repeat', type=int, default=20, help='Timing runs per case')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='Seconds per MongoDB operation')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,121 @@
 import os
+import threading
 from google.cloud import bigquery
 
+# Service account key file used unless the GOOGLE_APPLICATION_CREDENTIALS environment variable names one. Can be
+#  overridden by google_application_credentials in config.yaml.
+DEFAULT_CREDENTIALS_PATH = '../law-project-service-account.json'
+credentials_path = DEFAULT_CREDENTIALS_PATH
+# Created on first use in each process by get_client(), and closed by close_client() when the app shuts down.
+client: bigquery.Client | None = None
+# Queries run on several threads at once, which must not each create a client.
+_client_lock = threading.Lock()
 
-def query_patent(patent_spif: str) -> tuple[dict, bool]:
+# Need to UNNEST the struct of string arrays in several fields.
+# NOTE: New-lines here are purely visual, so need space at end of each line.
+PATENTS_QUERY = (
+    'SELECT spif_publication_number as spif, t.text as title,  a.text as abstract, c.text as claims '
+    'FROM `patents-public-data.patents.publications`, UNNEST(title_localized) as t, UNNEST(abstract_localized) as a,  UNNEST(claims_localized) as c '
+    'WHERE spif_publication_number IN UNNEST(@spifs) ')
+# Descriptions are by far the largest column, so they are fetched separately, after the rest of the patent is stored.
+DESCRIPTION_QUERY = (
+    'SELECT spif_publication_number as spif, d.text as description '
+    'FROM `patents-public-data.patents.publications`, UNNEST(description_localized) as d '
+    'WHERE spif_publication_number = @spif '
+    'LIMIT 1')
+
+
+def configure_big_query(config: dict) -> None:
+    """Remember the service account key file from config.yaml."""
+    global credentials_path
+    credentials_path = config.get('google_application_credentials', DEFAULT_CREDENTIALS_PATH)
+
+
+def get_client() -> bigquery.Client:
+    """Create the BigQuery client on first use and reuse it afterwards; building one costs an auth round trip."""
+    global client
+    with _client_lock:
+        if client is None:
+            # Credentials are passed to the client rather than set in os.environ, which is shared by the whole process.
+            if 'GOOGLE_APPLICATION_CREDENTIALS' in os.environ:
+                client = bigquery.Client()
+            else:
+                client = bigquery.Client.from_service_account_json(credentials_path)
+        return client
+
+
+def close_client() -> None:
+    global client
+    with _client_lock:
+        if client is not None:
+            client.close()
+            client = None
+
+
+def _forget_client_after_fork() -> None:
+    # A client created before the process forked (e.g. by an app preloaded before forking workers) would share its
+    #  connections with the parent, so the child makes its own. The lock may have been held by another thread at the fork.
+    global client, _client_lock
+    client = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_client_after_fork)
 
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = '../law-project-service-account.json'
-    client = bigquery.Client()
 
-    # Perform a query. Need to UNNEST the struct of string arrays in several fields.
-    # TODO Validate query so we don't get an injection attack.
-    QUERY = (
-        f'SELECT spif_publication_number as spif, t.text as title,  a.text as abstract, c.text as claims '
-        f'FROM `patents-public-data.patents.publications`, UNNEST(title_localized) as t, UNNEST(abstract_localized) as a,  UNNEST(claims_localized) as c '
-        f'WHERE spif_publication_number = "{patent_spif}" '
-        f'LIMIT 100')
+def query_patents(patent_spifs: list[str]) -> dict[str, dict]:
+    """Fetch several patents from BigQuery with a single query job.
 
-    query_job = client.query(QUERY)  # Send API request.
+    Args:
+        patent_spifs (list[str]): SPIFs of the patents to fetch, e.g. ['US8205344B2', 'US9889572B2']
+
+    Returns:
+        dict[str, dict]: Patent data keyed by SPIF. SPIFs that BigQuery does not know about are left out.
+    """
+    if not patent_spifs:
+        return dict()
+
+    # Passing the SPIFs as a query parameter rather than formatting them into the SQL prevents injection.
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter('spifs', 'STRING', list(patent_spifs))])
+    query_job = get_client().query(PATENTS_QUERY, job_config=job_config)  # Send API request.
     rows = query_job.result()  # Waits for query to finish.
 
-    # `rows` is an iterator, but SPIF should be unique to one patent, so we should only iterate once.
-    num_iters = 0
-    patent_data = dict()
+    patents = dict()
     for row in rows:
+        # The localized fields can hold more than one language; keep the first row returned for each patent.
+        if row.spif in patents:
+            continue
+        patents[row.spif] = {
+            'spif': row.spif,
+            'title': row.title,
+            'abstract': row.abstract,
+            'claims': row.claims,
+            # The description is added later by query_patent_description().
+        }
+
+    return patents
+
+
+def query_patent(patent_spif: str) -> tuple[dict, bool]:
 
-        patent_data['spif'] = row.spif
-        patent_data['title'] = row.title
-        patent_data['abstract'] = row.abstract
-        patent_data['claims'] = row.claims
-        # TODO Add in description
+    patent_data = query_patents([patent_spif]).get(patent_spif, dict())
 
-        num_iters += 1
-        assert num_iters == 1, f'More than one entry was returned from BigQuery query to patent SPIF {patent_spif}; that cannot be correct.'
-    
     found_patent_in_bq = True if len(patent_data) > 1 else False
-    return patent_data, found_patent_in_bq
\ No newline at end of file
+    return patent_data, found_patent_in_bq
+
+
+def query_patent_description(patent_spif: str) -> str | None:
+    """Fetch a patent's description from BigQuery.
+
+    Args:
+        patent_spif (str): SPIF of the patent, e.g. US8205344B2
+
+    Returns:
+        str | None: The description, or None if BigQuery has none for the patent.
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter('spif', 'STRING', patent_spif)])
+    rows = get_client().query(DESCRIPTION_QUERY, job_config=job_config).result()
+    for row in rows:
+        return row.description
+    return None
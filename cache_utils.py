@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+_MISSING = object()
+
+
+class AsyncLRUCache:
+    """In-process cache with a bounded number of entries (least recently used entries are evicted first) and an optional
+    time-to-live per entry. get_or_load() coalesces concurrent misses for the same key, so however many coroutines ask
+    for an uncached key at once, its loader only runs once and every caller gets the same result.
+
+    Not thread safe; it is meant to be used from the event loop only.
+    """
+
+    def __init__(self, max_size: int, ttl: float | None = None):
+        """
+        Args:
+            max_size (int): Maximum number of entries held at once.
+            ttl (float | None, optional): Seconds an entry stays valid after it is stored. Defaults to None (never expires).
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # Maps key to (expiry time according to time.monotonic() or None, value). Most recently used entries are at the end.
+        self._entries: OrderedDict[Hashable, tuple[float | None, Any]] = OrderedDict()
+        # Maps key to the future that the first caller to miss on that key will resolve with the loaded value.
+        self._in_flight: dict[Hashable, asyncio.Future] = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if it is not cached or has expired. Does not update the counters."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting the least recently used entries if the cache is full."""
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key from the cache and return its value, or default if it was not cached."""
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for key. On a miss, await loader() to get the value and cache it unless it is None.
+        If another caller is already loading key, wait for its result instead of calling loader() again.
+
+        Args:
+            key (Hashable): Cache key.
+            loader (Callable[[], Awaitable[Any]]): Called with no arguments to produce the value on a miss.
+
+        Returns:
+            Any: The cached or loaded value. None if loader() returned None.
+        """
+        while True:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+
+            self.coalesced += 1
+            try:
+                # Shield so that a follower being cancelled does not cancel the load everyone else is waiting on.
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                # If the loading caller was cancelled (rather than this one), try loading again ourselves.
+                if not in_flight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved so asyncio does not log it when nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> dict[str, int]:
+        """Counters describing how effective the cache has been since it was created."""
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,216 @@
+import re
+from collections import defaultdict
+from functools import cached_property
+
+# A claim starts at the beginning of a line with its number and a period, e.g. "2. The safety razor of claim 1".
+CLAIM_START_PATTERN = re.compile(r'^[ \t]*(\d+)[ \t]*\.\s', re.MULTILINE)
+# References to earlier claims, e.g. "of claim 1", "according to claims 2 or 3", "as in any one of claims 1-4". OCR'd
+#  patents sometimes have "claim l" for "claim 1". Starting with the literal "claim" (rather than \b) lets re skip
+#  straight to candidates, which is much faster; parse_claim_references() checks that it starts a word.
+CLAIM_REFERENCE_PATTERN = re.compile(r'claims?\s+((?:\d+|[lI]\b)(?:\s*(?:,|or|and|-|–|to|through)\s*(?:any\s+(?:one\s+)?of\s+)?(?:\d+|[lI]\b))*)')
+REFERENCE_TOKEN_PATTERN = re.compile(r'\d+|\b[lI]\b|-|–|\bto\b|\bthrough\b')
+# Separator of claims in BigQuery's claims text, used when claims are not numbered at the start of a line.
+CLAIM_SEPARATOR = '\n     \n     \n       '
+# Characters that get_word_set() strips from words.
+PUNCTUATION_TABLE = str.maketrans('', '', '.;,():\n')
+
+
+def get_word_set(multi_word_string: str) -> set:
+    """Split a string into lower cased words with numerics not included and remove punctuation. Then return only the unique words.
+
+    Args:
+        multi_word_string (str): What it sounds like
+
+    Returns:
+        set: Set of unique un-punctuated words
+    """
+    # Remove punctuation and new-lines, then assume words are split by spaces. None of the removed characters are spaces,
+    #  so removing them before splitting gives the same words as removing them from each word.
+    # Lower-casing the whole string at once is faster than lower-casing each word.
+    words = multi_word_string.translate(PUNCTUATION_TABLE).lower().split(' ')
+
+    # Get rid of any length-0 or length-1 words (e.g. '', 'a') and any numerics (e.g. '10').
+    return {word for word in words if len(word) > 1 and not word.isnumeric()}
+
+
+def find_claim_spans(claims: str) -> list[tuple[int, int, int]]:
+    """Find where each claim is in the claims text. Claims are numbered 1, 2, 3, ... so a number at the start of a line
+    only starts a claim if it is the next claim number, which keeps numbered lists inside a claim from splitting it.
+    If the claims are not numbered that way, they are split on CLAIM_SEPARATOR and numbered in order.
+
+    Returns:
+        list[tuple[int, int, int]]: (claim number, start, end) of each claim, in order. claims[start:end] is the claim's text.
+    """
+    starts, line_start = [], 0
+    # Matching at each line start is much faster than searching the whole text for the pattern.
+    while line_start >= 0:
+        match = CLAIM_START_PATTERN.match(claims, line_start)
+        if match is not None and int(match.group(1)) == len(starts) + 1:
+            starts.append(match.start(1))
+        line_start = claims.find('\n', line_start)
+        line_start = line_start + 1 if line_start >= 0 else -1
+    if not starts:
+        starts, position = [], 0
+        for claim in claims.split(CLAIM_SEPARATOR):
+            starts.append(position)
+            position += len(claim) + len(CLAIM_SEPARATOR)
+    ends = starts[1:] + [len(claims)]
+    return [(number, start, end) for number, (start, end) in enumerate(zip(starts, ends), start=1)]
+
+
+def parse_claim_references(claim_text: str, claim_number: int) -> list[int]:
+    """Numbers of the earlier claims that a claim refers to, e.g. [1] for "The razor of claim 1, wherein ..." and
+    [1, 2, 3, 4] for "as in any one of claims 1-4". A claim can only depend on claims before it, so other numbers are ignored.
+    """
+    references = set()
+    for match in CLAIM_REFERENCE_PATTERN.finditer(claim_text):
+        if match.start() > 0 and claim_text[match.start() - 1].isalnum():
+            continue
+        previous, in_range = None, False
+        for token in REFERENCE_TOKEN_PATTERN.findall(match.group(1)):
+            if token in ('-', '–', 'to', 'through'):
+                in_range = previous is not None
+                continue
+            number = 1 if token in ('l', 'I') else int(token)
+            if in_range:
+                references.update(range(previous + 1, number + 1))
+            else:
+                references.add(number)
+            previous, in_range = number, False
+    return sorted(number for number in references if 1 <= number < claim_number)
+
+
+class ClaimTree:
+    """The claims of a patent with the earlier claims each one depends on, and the words of each claim, so that claims
+    can be compared without re-tokenizing them.
+    """
+
+    def __init__(self, claims: list[dict], words: dict[int, set[str]]):
+        """
+        Args:
+            claims (list[dict]): One dict per claim, in order, with keys 'number', 'start' and 'end' (its position in
+        the claims text) and 'depends_on' (numbers of the claims it refers to).
+            words (dict[int, set[str]]): The words (see get_word_set()) of each claim's own text, keyed by claim number.
+        """
+        self.claims = claims
+        self.words = words
+        self.by_number = {claim['number']: claim for claim in claims}
+        self.children: dict[int, list[int]] = {claim['number']: [] for claim in claims}
+        for claim in claims:
+            for parent in claim['depends_on']:
+                self.children[parent].append(claim['number'])
+        # The independent claims each claim is, or descends from. Claims only depend on earlier ones, so their parents'
+        #  are always known already.
+        self.independent_claims_of: dict[int, list[int]] = dict()
+        for claim in claims:
+            parents = claim['depends_on']
+            if not parents:
+                self.independent_claims_of[claim['number']] = [claim['number']]
+            elif len(parents) == 1:
+                self.independent_claims_of[claim['number']] = self.independent_claims_of[parents[0]]
+            else:
+                self.independent_claims_of[claim['number']] = sorted(set().union(*[self.independent_claims_of[parent] for parent in parents]))
+
+    @cached_property
+    def ancestors(self) -> dict[int, set[int]]:
+        """Each claim's ancestors, i.e. every claim it incorporates directly or through other claims."""
+        ancestors = dict()
+        for claim in self.claims:
+            ancestors[claim['number']] = set(claim['depends_on']).union(*[ancestors[parent] for parent in claim['depends_on']])
+        return ancestors
+
+    @cached_property
+    def word_index(self) -> dict[str, list[int]]:
+        """Maps each word to the numbers of the claims it appears in. Only built when a word is looked up, since
+        analyze_claims() doesn't need it.
+        """
+        word_index = defaultdict(list)
+        for number, words in self.words.items():
+            for word in words:
+                word_index[word].append(number)
+        return dict(word_index)
+
+    @classmethod
+    def from_claims(cls, claims: str) -> 'ClaimTree':
+        """Parse the claims text of a patent, as stored in the `claims` field of a patent document."""
+        claim_list, words = [], dict()
+        for number, start, end in find_claim_spans(claims):
+            text = claims[start:end]
+            claim_list.append({'number': number, 'start': start, 'end': end, 'depends_on': parse_claim_references(text, number)})
+            words[number] = get_word_set(text)
+        return cls(claim_list, words)
+
+    @classmethod
+    def from_dict(cls, tree_dict: dict) -> 'ClaimTree':
+        """Inverse of to_dict()."""
+        claims = tree_dict['claims']
+        return cls(claims, {claim['number']: set(words) for claim, words in zip(claims, tree_dict['claim_words'])})
+
+    def to_dict(self) -> dict:
+        """Everything needed to rebuild the tree without re-tokenizing, in a form that can be stored as JSON or in MongoDB.
+        Words are not used as keys, since MongoDB restricts which strings can be.
+        """
+        return {'claims': self.claims, 'claim_words': [list(self.words[claim['number']]) for claim in self.claims]}
+
+    def __contains__(self, claim_number: int) -> bool:
+        return claim_number in self.by_number
+
+    @property
+    def independent_claims(self) -> list[int]:
+        return [claim['number'] for claim in self.claims if not claim['depends_on']]
+
+    def roots(self, claim_number: int) -> list[int]:
+        """The independent claims that a claim is, or descends from."""
+        return self.independent_claims_of[claim_number]
+
+    def claim_words(self, claim_number: int, inherited: bool = True) -> set[str]:
+        """Words of a claim, and of every claim it incorporates if inherited is True."""
+        if not inherited:
+            return self.words[claim_number]
+        return self.words[claim_number].union(*[self.words[number] for number in self.ancestors[claim_number]])
+
+    def claims_with_word(self, word: str) -> list[int]:
+        return self.word_index.get(word.lower(), [])
+
+    def groups(self) -> tuple[dict[str, list[int]], dict[str, set[str]]]:
+        """Group each independent claim with all claims that descend from it. A claim that depends on several
+        independent claims is in each of their groups.
+
+        Returns:
+            tuple[dict[str, list[int]], dict[str, set[str]]]: Positions in the claims list of the claims in each group,
+        and the words of each group, both keyed by the independent claim's number.
+        """
+        groups = {str(number): [] for number in self.independent_claims}
+        group_words = {str(number): set() for number in self.independent_claims}
+        for position, claim in enumerate(self.claims):
+            for root in self.independent_claims_of[claim['number']]:
+                groups[str(root)].append(position)
+                group_words[str(root)].update(self.words[claim['number']])
+        return groups, group_words
+
+    def diff(self, a: int, b: int, inherited: bool = True) -> dict:
+        """Compare the words of two claims (see claim_words()).
+
+        Returns:
+            dict: Keys 'a' and 'b', 'relation' ('same', 'a_depends_on_b', 'b_depends_on_a', 'same_family' if they
+        descend from a common independent claim, or 'unrelated') and the sorted words 'only_in_a', 'only_in_b' and 'shared'.
+        """
+        a_words, b_words = self.claim_words(a, inherited), self.claim_words(b, inherited)
+        if a == b:
+            relation = 'same'
+        elif b in self.ancestors[a]:
+            relation = 'a_depends_on_b'
+        elif a in self.ancestors[b]:
+            relation = 'b_depends_on_a'
+        elif set(self.independent_claims_of[a]) & set(self.independent_claims_of[b]):
+            relation = 'same_family'
+        else:
+            relation = 'unrelated'
+        return {
+            'a': a,
+            'b': b,
+            'relation': relation,
+            'only_in_a': sorted(a_words - b_words),
+            'only_in_b': sorted(b_words - a_words),
+            'shared': sorted(a_words & b_words),
+        }
@@ -0,0 +1,15 @@
+import os
+from functools import lru_cache
+
+import yaml
+
+# TODO Need to learn about more secure ways of doing auth.
+# Path of the YAML file holding credentials and settings. Can be overridden with the LAW_PROJECT_CONFIG environment variable.
+DEFAULT_CONFIG_PATH = '../config.yaml'
+
+
+@lru_cache(maxsize=1)
+def load_config() -> dict:
+    """Read the config file the first time this is called and return the same dict afterwards."""
+    with open(os.environ.get('LAW_PROJECT_CONFIG', DEFAULT_CONFIG_PATH), 'r') as f:
+        return yaml.safe_load(f)
@@ -0,0 +1,157 @@
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Hashable
+
+# Job statuses. A job is pending until its coroutine starts, and then running until it returns (succeeded) or raises (failed).
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+
+class Job:
+    """A unit of background work, e.g. ingesting one patent, whose progress clients can poll."""
+
+    def __init__(self, kind: str, key: Hashable):
+        """
+        Args:
+            kind (str): What the job does, e.g. 'patent'.
+            key (Hashable): What the job does it to, e.g. a SPIF. Only one job per kind and key runs at a time.
+        """
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = JOB_PENDING
+        self.result: Any = None
+        self.error: str | None = None
+        # What the job raised, if it failed, for callers that handle some failures differently (e.g. with a 404).
+        self.exception: BaseException | None = None
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        # IDs of jobs this one started, e.g. fetching a patent's description once its core fields are stored.
+        self.follow_up_job_ids: list[str] = []
+        self._done = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'key': self.key,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'follow_up_job_ids': self.follow_up_job_ids,
+        }
+
+
+class JobManager:
+    """Runs jobs as background tasks on the event loop, with their blocking calls (e.g. BigQuery queries) on a bounded
+    thread pool so that a burst of jobs cannot start an unbounded number of threads or block the event loop.
+    Submitting a job for a kind and key that already has one pending or running returns the existing job.
+
+    Finished jobs are remembered, up to max_finished_jobs of them, so that clients can still poll them for a while.
+    """
+
+    def __init__(self, max_workers: int, max_finished_jobs: int = 1000):
+        """
+        Args:
+            max_workers (int): Maximum number of threads running blocking calls for jobs at once.
+            max_finished_jobs (int, optional): Maximum number of finished jobs remembered. Defaults to 1000.
+        """
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        # The pool is created on first use so that constructing a JobManager has no side effects.
+        self._executor: ThreadPoolExecutor | None = None
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        # Maps (kind, key) to the ID of the pending or running job for it.
+        self._active: dict[tuple[str, Hashable], str] = dict()
+
+    def submit(self, kind: str, key: Hashable, run: Callable[[Job], Awaitable[Any]]) -> Job:
+        """Start a job that awaits run(job) in the background, unless one for the same kind and key is pending or running.
+
+        Args:
+            kind (str): What the job does, e.g. 'patent'.
+            key (Hashable): What the job does it to, e.g. a SPIF.
+            run (Callable[[Job], Awaitable[Any]]): Does the work. What it returns becomes the job's result; if it raises, the job fails.
+
+        Returns:
+            Job: The new job, or the existing one for kind and key.
+        """
+        active_job_id = self._active.get((kind, key))
+        if active_job_id is not None:
+            return self._jobs[active_job_id]
+
+        job = Job(kind, key)
+        self._jobs[job.job_id] = job
+        self._active[(kind, key)] = job.job_id
+        # The task is kept on the job so that it is not garbage collected while it runs. It gets a fresh context rather
+        #  than a copy of the submitting request's, since it outlives the request.
+        job._task = asyncio.get_running_loop().create_task(self._run(job, run), context=contextvars.Context())
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[Any]]) -> None:
+        job.status = JOB_RUNNING
+        try:
+            job.result = await run(job)
+            job.status = JOB_SUCCEEDED
+        except asyncio.CancelledError:
+            job.error = 'Cancelled'
+            job.exception = asyncio.CancelledError()
+            job.status = JOB_FAILED
+            raise
+        except Exception as e:
+            job.error = f'{type(e).__name__}: {e}'
+            job.exception = e
+            job.status = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            del self._active[(job.kind, job.key)]
+            job._done.set()
+            self._forget_old_jobs()
+
+    def _forget_old_jobs(self) -> None:
+        finished_job_ids = [job_id for job_id, job in self._jobs.items() if job.done]
+        # Jobs are ordered oldest first, so this forgets the oldest finished ones.
+        for job_id in finished_job_ids[:max(len(finished_job_ids) - self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """Wait up to timeout seconds for job to finish, and return it whether or not it has."""
+        try:
+            await asyncio.wait_for(job._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    async def run_in_pool(self, func: Callable[..., Any], *args) -> Any:
+        """Call func(*args) on the thread pool and await its result."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def shutdown(self) -> None:
+        """Cancel unfinished jobs and stop the thread pool. Blocking calls already running are not interrupted."""
+        for job in self._jobs.values():
+            if job._task is not None and not job.done:
+                job._task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict[str, int]:
+        statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (JOB_PENDING, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED)}
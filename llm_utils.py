@@ -1,43 +1,135 @@
+import asyncio
+import hashlib
 import json
+import logging
 import re
-import yaml
-import os
+import time
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable
 
+import tiktoken
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts.chat import (
-    ChatPromptTemplate,
     SystemMessagePromptTemplate,
-    AIMessagePromptTemplate,
     HumanMessagePromptTemplate,
 )
 from langchain.schema import (
     AIMessage,
+    BaseMessage,
     HumanMessage,
+    LLMResult,
     SystemMessage,
     PromptValue
 )
 
-# TODO Need to learn about more secure ways of doing auth.
-with open('../config.yaml', 'r') as f:
-    __keys = yaml.safe_load(f)
-
-os.environ["OPENAI_API_KEY"] = __keys['openai']
-os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = '../law-project-service-account.json'
-
-
-def construct_ai_prompt(chat: list[dict[str, str]], patent: dict | str) -> PromptValue:
-
-    # First, define templates. TODO this should be extracted elsewhere and choice of template made configurable for easy experimentation.
-    sys_msg_template = """
-    You are a helpful assistant to a patent lawyer. The lawyer wants your help understanding a patent. Address him or her in the second person.
-    Answer the lawyer's questions about the patent in 150 words or less. Cite text from the patent in quotes in your answer. If you don't know the answer, just say that you don't know. 
+from cache_utils import AsyncLRUCache
+from claims_utils import ClaimTree, find_claim_spans
+from metrics_utils import record_llm_route, record_llm_tokens, stage
+from retrieval_utils import ChunkIndex, rank_chunks
+
+logger = logging.getLogger(__name__)
+
+# Set by configure_llm() when the app starts. If it is None, ChatOpenAI falls back to the OPENAI_API_KEY environment variable.
+openai_api_key: str | None = None
+# Whether AI responses are also stored in the DB (see agenerate_ai_response()), so that they survive restarts. Set by configure_llm().
+persist_ai_responses = False
+
+
+def configure_llm(config: dict) -> None:
+    """Remember the OpenAI API key, the AI response cache settings and the model routing settings from config.yaml."""
+    global openai_api_key, persist_ai_responses, model_routes, llm_latency_budget_seconds, compare_max_concurrency, compare_timeout_seconds
+    openai_api_key = config['openai']
+    persist_ai_responses = config.get('persist_ai_responses', False)
+    model_routes = {**MODEL_ROUTES, **config.get('model_routes', dict())}
+    llm_latency_budget_seconds = config.get('llm_latency_budget_seconds', LLM_LATENCY_BUDGET_SECONDS)
+    compare_max_concurrency = config.get('compare_max_concurrency', COMPARE_MAX_CONCURRENCY)
+    compare_timeout_seconds = config.get('compare_timeout_seconds', COMPARE_TIMEOUT_SECONDS)
+
+
+def make_chat_model(**kwargs) -> ChatOpenAI:
+    """Make a ChatOpenAI using the configured API key. kwargs are passed on to ChatOpenAI."""
+    if openai_api_key is not None:
+        kwargs.setdefault('openai_api_key', openai_api_key)
+    return ChatOpenAI(**kwargs)
+
+
+# Model whose tokenizer is used to count prompt tokens. ChatOpenAI's default model.
+PROMPT_MODEL_NAME = 'gpt-3.5-turbo'
+# gpt-3.5-turbo has a 4,096 token context window, and answers are asked to be under 150 words (~200 tokens).
+DEFAULT_PROMPT_TOKEN_BUDGET = 3500
+# Each chat message costs a few tokens on top of its content for the role and delimiters.
+MESSAGE_TOKEN_OVERHEAD = 4
+# When the patent and the chat history don't both fit, the patent gets at least this share of the tokens left after
+#  the instructions and the question.
+PATENT_TOKEN_SHARE = 0.6
+# A text section of the patent is truncated to fit only if at least this many of its tokens fit; otherwise it is omitted.
+MIN_TRUNCATED_SECTION_TOKENS = 50
+# Maximum number of patent chunks (see chunk_patent()) retrieved for the prompt, across all of the user's patents.
+RETRIEVAL_TOP_K = 12
+# Descriptions are split into chunks of about this many words.
+DESCRIPTION_CHUNK_WORDS = 200
+# Bump whenever chunk_patent() or retrieval_utils' tokenization changes, so that stored patent indices get rebuilt.
+RETRIEVAL_INDEX_VERSION = 2
+# Patent indices are loaded from the DB when first needed and then kept in memory, up to this many.
+PATENT_INDEX_CACHE_MAX_SIZE = 256
+patent_index_cache = AsyncLRUCache(max_size=PATENT_INDEX_CACHE_MAX_SIZE)
+# Parameters of the chat model answering the lawyer. Temperature 0 makes responses deterministic, which is what makes caching them valid.
+CHAT_MODEL_PARAMS = {'temperature': 0}
+# Recent AI responses are kept in memory keyed by get_ai_response_cache_key(), up to this many and for this long.
+AI_RESPONSE_CACHE_MAX_SIZE = 1024
+AI_RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+ai_response_cache = AsyncLRUCache(max_size=AI_RESPONSE_CACHE_MAX_SIZE, ttl=AI_RESPONSE_CACHE_TTL_SECONDS)
+# Hits and misses when looking up responses stored in the DB, which happens after missing the in-memory cache.
+ai_response_store_stats = {'hits': 0, 'misses': 0}
+# Routes a chat turn can take (see choose_model_route()): the model answering, the most tokens it may answer with
+#  (answers are asked to be under 150 words, about 200 tokens) and the seconds a whole response is expected to take
+#  until some have been timed. Routes can be changed or added with model_routes in config.yaml.
+MODEL_ROUTES = {
+    'quick': {'model_name': 'gpt-3.5-turbo', 'max_tokens': 200, 'expected_seconds': 3.0},
+    'standard': {'model_name': 'gpt-3.5-turbo', 'max_tokens': 300, 'expected_seconds': 5.0},
+    'analysis': {'model_name': 'gpt-4', 'max_tokens': 400, 'expected_seconds': 15.0},
+}
+model_routes = MODEL_ROUTES
+# Route of turns that were not routed by choose_model_route().
+DEFAULT_MODEL_ROUTE = 'standard'
+# Route taken instead of the chosen one when that is about to use up the turn's latency budget.
+FALLBACK_MODEL_ROUTE = 'quick'
+# Seconds a chat turn may take from the start of its request to having the whole AI response. Can be overridden by
+#  llm_latency_budget_seconds in config.yaml.
+LLM_LATENCY_BUDGET_SECONDS = 20.0
+llm_latency_budget_seconds = LLM_LATENCY_BUDGET_SECONDS
+# Questions asking to compare or analyze claims, prior art and the like, rather than to explain something.
+ANALYSIS_QUESTION_PATTERN = re.compile(
+    r'\b(compar\w*|differ\w*|versus|vs|infring\w*|prior art|anticipat\w*|obvious\w*|novel\w*|analy[sz]\w*|each claim|every claim|all (of the )?claims)\b',
+    re.IGNORECASE)
+# Other questions with at most this many tokens are clarifications, e.g. "What does 'substrate' mean here?".
+CLARIFICATION_MAX_TOKENS = 20
+# Analysis questions only get the analysis route if their prompt has at least this many tokens, i.e. patent text to
+#  analyze; a larger model does not help with a nearly empty prompt.
+ANALYSIS_MIN_PROMPT_TOKENS = 1000
+# Weight of the latest timing in each route's moving average of response times.
+ROUTE_LATENCY_SMOOTHING = 0.2
+# Moving average of the seconds each route's responses took, once it has been timed.
+route_latency_estimates: dict[str, float] = dict()
+# Most per-patent sub-questions of a comparison (see acompare_patents()) sent to OpenAI at once, and the seconds each
+#  LLM call of a comparison may take. Can be overridden by compare_max_concurrency and compare_timeout_seconds in config.yaml.
+COMPARE_MAX_CONCURRENCY = 4
+COMPARE_TIMEOUT_SECONDS = 30.0
+compare_max_concurrency = COMPARE_MAX_CONCURRENCY
+compare_timeout_seconds = COMPARE_TIMEOUT_SECONDS
+
+# TODO Templates should be extracted elsewhere and choice of template made configurable for easy experimentation.
+SYS_MSG_TEMPLATE = """
+    You are a helpful assistant to a patent lawyer. The lawyer wants your help understanding one or more patents. Address him or her in the second person.
+    Answer the lawyer's questions about the patents in 150 words or less. Cite text from the patents in quotes in your answer. If you don't know the answer, just say that you don't know. 
     Don't try to make up an answer. If you are uncertain about any part of your answer, say so. If the user has not specified a patent, request that they do so.
 
-    Use the following information in thinking through your answer. First, the patent is delimited by triple backticks. Second, the words that appear uniquely in each independent claim are
-    given in a JSON delimited by triple backticks. For example, independent claim 1 has key '1' in the JSON, and its values are all words that appear only in independent claim 1 and its
-    dependent claims.
+    Use the following information in thinking through your answer. First, the title of each patent and the excerpts of the patents most relevant to the question are given in a JSON
+    delimited by triple backticks. Each key is a patent's SPIF followed by the part of the patent the excerpt comes from, e.g. 'US8205344B2 claim 3'. Second, the words that appear
+    uniquely in each independent claim are given in a JSON delimited by triple backticks. Its keys are patent SPIFs. For example, independent claim 1 of a patent has key '1' in that
+    patent's JSON, and its values are all words that appear only in independent claim 1 and its dependent claims.
 
-    Patent: 
+    Patent Excerpts: 
     ```
     {patent}
     ```
@@ -47,146 +139,760 @@ def construct_ai_prompt(chat: list[dict[str, str]], patent: dict | str) -> Promp
     ```
     """
 
-    sys_msg_prompt_template = SystemMessagePromptTemplate.from_template(sys_msg_template)
-
-    human_template = """The lawyer's question is delimited with triple backticks. Answer the question in fewer than 150 words.
+HUMAN_TEMPLATE = """The lawyer's question is delimited with triple backticks. Answer the question in fewer than 150 words.
 
     Lawyer's question: '''{question}'''"""
 
-    human_msg_prompt_template = HumanMessagePromptTemplate.from_template(human_template)
+SUB_QUESTION_TEMPLATE = """The lawyer is comparing several patents. Considering only patent {spif}, answer the part of this question
+    that concerns it: {question}"""
+
+COMPARE_SYS_MSG_TEMPLATE = """
+    You are a helpful assistant to a patent lawyer who is comparing patents. Address him or her in the second person.
+    Answer the lawyer's question in 150 words or less by combining the answers below, each about a single patent. Only use what those answers say.
+    If an answer is missing or says it does not know, say that you don't know about that patent.
+
+    The answers are given in a JSON delimited by triple backticks. Each key is a patent's SPIF and each value is the answer about that patent.
+    ```
+    {sub_answers}
+    ```
+    """
+
+OMITTED_CHAT_TEMPLATE = 'The {num_omitted} earliest messages of this conversation were omitted to fit the context window.'
+OMITTED_SECTION_TEXT = 'Omitted to fit the context window.'
+TRUNCATED_SECTION_SUFFIX = ' [truncated]'
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(PROMPT_MODEL_NAME)
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens PROMPT_MODEL_NAME's tokenizer splits text into."""
+    return len(get_tokenizer().encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    return count_tokens(message.content) + MESSAGE_TOKEN_OVERHEAD
+
+
+def get_prompt_messages(chat_prompt: PromptValue) -> list[BaseMessage]:
+    # construct_ai_prompt() returns a plain list of messages rather than a PromptValue.
+    return chat_prompt.to_messages() if isinstance(chat_prompt, PromptValue) else chat_prompt
+
+
+def count_prompt_tokens(chat_prompt: PromptValue) -> int:
+    return sum(count_message_tokens(message) for message in get_prompt_messages(chat_prompt))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to its first max_tokens tokens, marking it as truncated if anything was cut."""
+    tokens = get_tokenizer().encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    suffix_tokens = count_tokens(TRUNCATED_SECTION_SUFFIX)
+    return get_tokenizer().decode(tokens[:max(max_tokens - suffix_tokens, 0)]) + TRUNCATED_SECTION_SUFFIX
+
+
+def chunk_patent(patent: dict) -> list[dict]:
+    """Split a patent into the pieces retrieval chooses between: the abstract, each claim, and roughly
+    DESCRIPTION_CHUNK_WORDS-word parts of the description.
+
+    Args:
+        patent (dict): Patent document
+
+    Returns:
+        list[dict]: Chunks in the order they appear in the patent, each with keys 'spif', 'section' (e.g. 'abstract',
+    'claim 3' or 'description part 2') and 'text'.
+    """
+    chunks = []
+    if patent.get('abstract'):
+        chunks.append({'spif': patent['spif'], 'section': 'abstract', 'text': patent['abstract']})
+
+    # Claims are numbered the same way as by /api/patent/{patent_spif}/claims, so excerpts and that endpoint agree.
+    claims = patent.get('claims', '')
+    for claim_num, start, end in find_claim_spans(claims):
+        claim = claims[start:end].strip()
+        if claim:
+            chunks.append({'spif': patent['spif'], 'section': f'claim {claim_num}', 'text': claim})
+
+    description_words = patent.get('description', '').split()
+    for part, start in enumerate(range(0, len(description_words), DESCRIPTION_CHUNK_WORDS)):
+        chunks.append({'spif': patent['spif'],
+                       'section': f'description part {part + 1}',
+                       'text': ' '.join(description_words[start:start + DESCRIPTION_CHUNK_WORDS])})
+
+    return chunks
+
+
+def build_patent_index(patent: dict) -> dict:
+    """Build the retrieval index for a patent, ready to be stored in the DB.
+
+    Args:
+        patent (dict): Patent document
+
+    Returns:
+        dict: Dictionary with keys 'spif', 'version' (RETRIEVAL_INDEX_VERSION) and those of ChunkIndex.to_dict().
+    """
+    index = ChunkIndex.from_chunks(chunk_patent(patent))
+    return {'spif': patent['spif'], 'version': RETRIEVAL_INDEX_VERSION, **index.to_dict()}
+
+
+async def get_patent_index(patent: dict,
+                           fetch_stored_index: Callable[[str, int], Awaitable[dict | None]],
+                           store_index: Callable[[dict], Awaitable[None]]) -> ChunkIndex:
+    """Get the retrieval index for a patent, from memory if it was used recently, otherwise from the DB. Only if it
+    was never stored (e.g. the patent was ingested by an older version of this code) is it built and then stored, so
+    that this happens once per patent and RETRIEVAL_INDEX_VERSION rather than once per chat turn or restart.
+
+    Args:
+        patent (dict): Patent document
+        fetch_stored_index (Callable[[str, int], Awaitable[dict | None]]): Given a SPIF and index version, returns the stored index or None.
+        store_index (Callable[[dict], Awaitable[None]]): Stores an index as returned by build_patent_index().
+
+    Returns:
+        ChunkIndex: The patent's index
+    """
+    async def load_index() -> ChunkIndex:
+        stored_index = await fetch_stored_index(patent['spif'], RETRIEVAL_INDEX_VERSION)
+        if stored_index is None:
+            stored_index = build_patent_index(patent)
+            await store_index(stored_index)
+        return ChunkIndex.from_dict(stored_index)
+
+    return await patent_index_cache.get_or_load((patent['spif'], RETRIEVAL_INDEX_VERSION), load_index)
+
+
+def forget_patent_index(patent_spif: str) -> None:
+    """Drop the in-memory copy of a patent's index, e.g. after a new one was stored because the patent gained its description."""
+    patent_index_cache.pop((patent_spif, RETRIEVAL_INDEX_VERSION))
+
+
+def get_patent_prompt_sections(patents: list[dict], question: str, indices: list[ChunkIndex] | None = None) -> list[tuple[str, object]]:
+    """The parts of the patents that can go in the prompt as (name, value) pairs, most important first: each patent's
+    title, then the RETRIEVAL_TOP_K chunks across all patents that best match question, then the unique word lists.
+
+    Args:
+        patents (list[dict]): Patent documents
+        question (str): The lawyer's question
+        indices (list[ChunkIndex] | None, optional): Retrieval index of each patent, e.g. from get_patent_index(). Defaults to None (build them here).
+
+    Returns:
+        list[tuple[str, object]]: Sections named '<spif> <part of patent>', followed by one named 'unique_words'
+    whose value maps each SPIF to its claim analysis's unique word lists.
+    """
+    sections = [(f'{patent["spif"]} title', patent.get('title', '')) for patent in patents]
+
+    if indices is None:
+        indices = [ChunkIndex.from_chunks(chunk_patent(patent)) for patent in patents]
+    for _, chunk in rank_chunks(indices, question, RETRIEVAL_TOP_K):
+        sections.append((f'{chunk["spif"]} {chunk["section"]}', chunk['text']))
+
+    sections.append(('unique_words', {patent['spif']: get_claim_analysis(patent)['unique_words'] for patent in patents}))
+    return sections
 
-    # Define list of messages to be input to AI. PromptTemplate entries don't yet have values filled in; that will happen later.
-    messages = [sys_msg_prompt_template]
-    # Append each previous message to the chat.
-    for i, msg in enumerate(chat):
 
-        if i == len(chat) - 1:
-            # Last chat message gets special treatment as a HumanMessagePromptTemplate with values to fill in.
-            messages.append(human_msg_prompt_template)
+def fit_patent_sections(sections: list[tuple[str, object]], token_budget: int) -> tuple[dict, dict[str, list[str]], int]:
+    """Choose which patent sections go in the prompt. Sections are taken in order while they fit in token_budget. A text
+    section that does not fit is truncated to the tokens left, as long as that is at least MIN_TRUNCATED_SECTION_TOKENS;
+    any other section that does not fit is omitted.
+
+    Args:
+        sections (list[tuple[str, object]]): (name, value) pairs, e.g. as returned by get_patent_prompt_sections()
+        token_budget (int): Tokens available for the patent
+
+    Returns:
+        tuple[dict, dict[str, list[str]], int]: The sections to put in the prompt, the names of the sections that were
+    'included', 'truncated' and 'omitted', and roughly how many tokens the chosen sections take.
+    """
+    chosen = dict()
+    included, truncated, omitted = [], [], []
+    tokens_used = 0
+    for name, value in sections:
+        section_tokens = count_tokens(json.dumps({name: value}))
+        tokens_left = token_budget - tokens_used
+        if section_tokens <= tokens_left:
+            chosen[name] = value
+            included.append(name)
+            tokens_used += section_tokens
             continue
 
-        messages.append(AIMessage(content=msg['msg']) if msg['source'] == 'ai' else HumanMessage(content=msg['msg']))
+        name_tokens = count_tokens(json.dumps({name: ''}))
+        if type(value) == str and tokens_left - name_tokens >= MIN_TRUNCATED_SECTION_TOKENS:
+            chosen[name] = truncate_to_tokens(value, tokens_left - name_tokens)
+            truncated.append(name)
+            tokens_used += count_tokens(json.dumps({name: chosen[name]}))
+        else:
+            omitted.append(name)
 
+    return chosen, {'included': included, 'truncated': truncated, 'omitted': omitted}, tokens_used
 
-    # chat_prompt_template = ChatPromptTemplate.from_messages([sys_msg_prompt_template, human_msg_prompt_template])
-    chat_prompt_template = ChatPromptTemplate.from_messages(messages)
 
-    # Remove MongoDB _id field. It is unserializable, and while we could convert it to a string before serializing,
-    #  it is not helpful to have in the prompt, so no point.
-    if type(patent) == dict:
-        patent_for_prompt = patent.copy()
-        if '_id' in patent_for_prompt.keys():
-            patent_for_prompt.pop('_id')
-        patent_as_string = json.dumps(patent_for_prompt)
-        
-        unique_word_lists = get_unique_words_per_indep_claim(patent['claims'])
-    else:
-        print('Warning: No patent has been specified.')
-        patent_as_string = patent
+def construct_ai_prompt(chat: list[dict[str, str]], patents: list[dict], token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+                        patent_indices: list[ChunkIndex] | None = None) -> tuple[PromptValue, dict]:
+    """Build the messages to send to the AI, keeping them within token_budget tokens (counted with PROMPT_MODEL_NAME's
+    tokenizer) so that latency and cost per turn stay predictable however long the chat or the patent is.
 
-        unique_word_lists = 'No patent was specified.'
+    The instructions and the lawyer's question are always included. Only the parts of the patents most relevant to the
+    question are considered (see get_patent_prompt_sections()). If everything else does not fit, the patents get
+    at least PATENT_TOKEN_SHARE of what is left; their sections are included most important first, and ones that
+    do not fit are truncated or omitted. The rest goes to the chat history, newest messages first, each kept verbatim;
+    older messages that do not fit are omitted, and the AI is told how many were. If the instructions and the question
+    alone do not fit, the question is truncated.
+
+    Args:
+        chat (list[dict[str, str]]): The user's chat. The last message must be from the user and is the question to answer.
+        patents (list[dict]): Patent documents the user is asking about. May be empty.
+        token_budget (int, optional): Maximum number of prompt tokens. Defaults to DEFAULT_PROMPT_TOKEN_BUDGET.
+        patent_indices (list[ChunkIndex] | None, optional): Retrieval index of each patent. Defaults to None (build them here).
+
+    Returns:
+        tuple[PromptValue, dict]: The list of messages, and a report of what went into them with keys 'token_budget',
+    'prompt_tokens', 'chat_messages_included', 'chat_messages_omitted', 'patent_sections_included',
+    'patent_sections_truncated', 'patent_sections_omitted' and 'question_truncated'.
+
+    Raises:
+        ValueError: If the instructions alone take more than token_budget tokens.
+    """
+
+    sys_msg_prompt_template = SystemMessagePromptTemplate.from_template(SYS_MSG_TEMPLATE)
+    human_msg_prompt_template = HumanMessagePromptTemplate.from_template(HUMAN_TEMPLATE)
 
     # Validate last input in message history as being from user.
     question = chat[-1]
     assert question['source'] == 'user', \
         f'Attempting to construct an AI prompt when last message was from `{question["source"]}`. Needs to be from `user`.'
-    question_txt = question['msg']
+    question_msg = human_msg_prompt_template.format(question=question['msg'])
+
+    def format_sys_msg(patent_for_prompt: dict) -> BaseMessage:
+        if not patents:
+            return sys_msg_prompt_template.format(patent='No patent is available', unique_words=json.dumps('No patent was specified.'))
+        patent_sections = dict(patent_for_prompt)
+        unique_word_lists = patent_sections.pop('unique_words', OMITTED_SECTION_TEXT)
+        return sys_msg_prompt_template.format(patent=json.dumps(patent_sections), unique_words=json.dumps(unique_word_lists))
+
+    def count_omitted_chat_tokens(num_omitted: int) -> int:
+        return count_message_tokens(SystemMessage(content=OMITTED_CHAT_TEMPLATE.format(num_omitted=num_omitted))) if num_omitted > 0 else 0
+
+    # The instructions and the question are always sent, so only the rest of the budget is shared out. The instructions
+    # are counted with the placeholders they have when no patent section fits.
+    fixed_tokens = count_message_tokens(format_sys_msg(dict())) + count_message_tokens(question_msg)
+    tokens_left = max(token_budget - fixed_tokens, 0)
+
+    if patents:
+        sections = get_patent_prompt_sections(patents, question['msg'], patent_indices)
+    else:
+        print('Warning: No patent has been specified.')
+        sections = []
+
+    history = [AIMessage(content=msg['msg']) if msg['source'] == 'ai' else HumanMessage(content=msg['msg']) for msg in chat[:-1]]
+    history_tokens = [count_message_tokens(msg) for msg in history]
+
+    patent_tokens_needed = sum(count_tokens(json.dumps({name: value})) for name, value in sections)
+    if patent_tokens_needed + sum(history_tokens) <= tokens_left:
+        patent_token_budget = patent_tokens_needed
+    else:
+        patent_token_budget = min(patent_tokens_needed, max(tokens_left - sum(history_tokens), int(tokens_left * PATENT_TOKEN_SHARE)))
+    patent_for_prompt, section_report, patent_tokens = fit_patent_sections(sections, patent_token_budget)
+
+    # Keep the newest messages verbatim, leaving room to say how many older ones were omitted if any are.
+    history_token_budget = tokens_left - patent_tokens
+    if sum(history_tokens) > history_token_budget:
+        history_token_budget -= count_omitted_chat_tokens(len(history))
+    num_included = 0
+    history_tokens_used = 0
+    for msg_tokens in reversed(history_tokens):
+        if history_tokens_used + msg_tokens > history_token_budget:
+            break
+        history_tokens_used += msg_tokens
+        num_included += 1
+    num_omitted = len(history) - num_included
+
+    # The shares above are estimates, as patent sections are counted one at a time. Count the prompt as it will be sent
+    # and, while it is over budget, omit more of the history, then fit the patent in fewer tokens, then truncate the question.
+    question_max_tokens = count_tokens(question['msg'])
+    question_truncated = False
+    while True:
+        sys_msg = format_sys_msg(patent_for_prompt)
+        prompt_tokens = (count_message_tokens(sys_msg) + count_omitted_chat_tokens(num_omitted) + sum(history_tokens[num_omitted:])
+                         + count_message_tokens(question_msg))
+        overflow = prompt_tokens - token_budget
+        if overflow <= 0:
+            break
+        if num_omitted < len(history):
+            num_omitted += 1
+        elif patent_token_budget > 0:
+            patent_token_budget = max(patent_token_budget - overflow, 0)
+            patent_for_prompt, section_report, _ = fit_patent_sections(sections, patent_token_budget)
+        elif question_max_tokens > 0:
+            question_max_tokens = max(question_max_tokens - overflow, 0)
+            question_msg = human_msg_prompt_template.format(question=truncate_to_tokens(question['msg'], question_max_tokens))
+            question_truncated = True
+        else:
+            raise ValueError(f'The prompt takes {prompt_tokens} tokens without the chat history, the patent or the question, '
+                             f'more than the token budget of {token_budget}.')
 
-    # Get a chat completion from the formatted messages.
     # Both page_content and 'source' key of metadata are injected into prompt in document QA. Formatting still unclear. For now just passing page_content because only have single doc.
-    chat_prompt = chat_prompt_template.format_prompt(question=question_txt, 
-                                                     patent=patent_as_string, 
-                                                     unique_words=json.dumps(unique_word_lists)).to_messages()
-    return chat_prompt
+    messages = [sys_msg]
+    if num_omitted > 0:
+        messages.append(SystemMessage(content=OMITTED_CHAT_TEMPLATE.format(num_omitted=num_omitted)))
+    messages.extend(history[num_omitted:])
+    messages.append(question_msg)
+
+    report = {
+        'token_budget': token_budget,
+        'prompt_tokens': prompt_tokens,
+        'chat_messages_included': len(history) - num_omitted,
+        'chat_messages_omitted': num_omitted,
+        'patent_sections_included': section_report['included'],
+        'patent_sections_truncated': section_report['truncated'],
+        'patent_sections_omitted': section_report['omitted'],
+        'question_truncated': question_truncated,
+    }
+    return messages, report
+
+
+def classify_question(question: str) -> str:
+    """'analysis' if question asks to compare or analyze (see ANALYSIS_QUESTION_PATTERN), 'clarification' if it is
+    short, and 'general' otherwise.
+    """
+    if ANALYSIS_QUESTION_PATTERN.search(question):
+        return 'analysis'
+    if count_tokens(question) <= CLARIFICATION_MAX_TOKENS:
+        return 'clarification'
+    return 'general'
 
 
-def generate_ai_response(chat_prompt: PromptValue) -> str:
-    """Given a prompt, generate the AI's response.
+def choose_model_route(question: str, prompt_tokens: int) -> dict:
+    """Pick the route (see MODEL_ROUTES) of a chat turn, i.e. which model answers and with how many tokens at most,
+    from the type of question and the size of the prompt built for it.
+
+    Args:
+        question (str): The lawyer's message the turn answers.
+        prompt_tokens (int): Tokens in the prompt, as reported by construct_ai_prompt().
+
+    Returns:
+        dict: The route's name ('route'), 'question_type' and 'prompt_tokens', to pass to agenerate_ai_response() or astream_ai_response().
+    """
+    question_type = classify_question(question)
+    if question_type == 'clarification':
+        route = 'quick'
+    elif question_type == 'analysis' and prompt_tokens >= ANALYSIS_MIN_PROMPT_TOKENS:
+        route = 'analysis'
+    else:
+        route = 'standard'
+    return {'route': route, 'question_type': question_type, 'prompt_tokens': prompt_tokens}
+
+
+def make_llm_deadline() -> float:
+    """time.monotonic() by which a turn whose request starts now should have its whole AI response."""
+    return time.monotonic() + llm_latency_budget_seconds
+
+
+def make_route_chat_model(route_name: str, **kwargs) -> ChatOpenAI:
+    """Make the chat model of a route. kwargs are passed on to make_chat_model()."""
+    route = model_routes[route_name]
+    return make_chat_model(**CHAT_MODEL_PARAMS, model_name=route['model_name'], max_tokens=route['max_tokens'], **kwargs)
+
+
+def estimate_route_seconds(route_name: str) -> float:
+    return route_latency_estimates.get(route_name, model_routes[route_name]['expected_seconds'])
+
+
+def observe_route_seconds(route_name: str, seconds: float) -> None:
+    estimate = route_latency_estimates.get(route_name)
+    route_latency_estimates[route_name] = seconds if estimate is None else estimate + ROUTE_LATENCY_SMOOTHING * (seconds - estimate)
+
+
+def get_route_timeout(route_name: str, deadline: float | None) -> float | None:
+    """Seconds the route may run before only just enough of the latency budget is left for the fallback route to answer.
+
+    Returns:
+        float | None: None if there is no limit (no deadline, or the route is the fallback). 0 or less if the fallback route should answer right away.
+    """
+    if deadline is None or route_name == FALLBACK_MODEL_ROUTE:
+        return None
+    return deadline - time.monotonic() - estimate_route_seconds(FALLBACK_MODEL_ROUTE)
+
+
+def record_model_route(route: dict, route_taken: str, seconds: float) -> None:
+    """Log and export (see metrics_utils) which route a turn took and how long its LLM call ran, to tune the routing from."""
+    record_llm_route(route['question_type'], route['route'], route_taken, seconds)
+    logger.info('AI turn route: %s', {**route, 'route_taken': route_taken, 'seconds': round(seconds, 3),
+                                      'estimated_seconds': round(estimate_route_seconds(route_taken), 3)})
+
+
+def get_model_route_stats() -> dict[str, dict]:
+    """Each route's settings and its current response time estimate."""
+    return {name: {**route, 'estimated_seconds': estimate_route_seconds(name)} for name, route in model_routes.items()}
+
+
+def construct_sub_question_prompt(question: str, patent: dict, patent_index: ChunkIndex | None = None) -> tuple[str, PromptValue, dict]:
+    """Build the prompt asking about a single patent's part in the comparison question (see construct_ai_prompt()).
+
+    Returns:
+        tuple[str, PromptValue, dict]: The sub-question, its prompt and construct_ai_prompt()'s report.
+    """
+    sub_question = SUB_QUESTION_TEMPLATE.format(spif=patent['spif'], question=question)
+    indices = None if patent_index is None else [patent_index]
+    prompt, report = construct_ai_prompt([{'source': 'user', 'msg': sub_question}], [patent], patent_indices=indices)
+    return sub_question, prompt, report
+
+
+def construct_comparison_prompt(question: str, sub_answers: list[dict]) -> PromptValue:
+    """Build the prompt combining the answers to a comparison's sub-questions (see acompare_patents()) into one."""
+    sys_msg_prompt_template = SystemMessagePromptTemplate.from_template(COMPARE_SYS_MSG_TEMPLATE)
+    human_msg_prompt_template = HumanMessagePromptTemplate.from_template(HUMAN_TEMPLATE)
+    answers = {sub_answer['spif']: sub_answer['msg'] if sub_answer['status'] == 'answered' else 'No answer.' for sub_answer in sub_answers}
+    return [sys_msg_prompt_template.format(sub_answers=json.dumps(answers)), human_msg_prompt_template.format(question=question)]
+
+
+async def acompare_patents(question: str,
+                           patents: list[dict],
+                           patent_indices: list[ChunkIndex] | None = None,
+                           use_cache: bool = True,
+                           fetch_stored_response: Callable[[str], Awaitable[str | None]] | None = None,
+                           store_response: Callable[[str, str], Awaitable[None]] | None = None) -> dict:
+    """Answer a question comparing patents: ask it about each patent separately, then have the LLM combine the answers.
+
+    The per-patent sub-questions are sent concurrently, at most compare_max_concurrency at a time, so a comparison
+    takes about as long as one sub-question plus the combining call however many patents it covers. Each LLM call may
+    take compare_timeout_seconds at most; that is also its latency budget for model routing (see agenerate_ai_response(),
+    whose caching arguments this takes too). A sub-question that times out or fails is left out of the combined
+    answer, which says so.
+
+    Args:
+        question (str): The lawyer's comparison question, e.g. 'How do the independent claims of these patents differ?'
+        patents (list[dict]): Patent documents to compare
+        patent_indices (list[ChunkIndex] | None, optional): Retrieval index of each patent. Defaults to None (build them here).
+
+    Returns:
+        dict: The combined answer ('msg', None if no sub-question was answered) and 'sub_answers', one per patent with
+    keys 'spif', 'question', 'msg' and 'status' ('answered', 'timed_out' or 'failed').
+    """
+    semaphore = asyncio.Semaphore(compare_max_concurrency)
+
+    async def answer(patent: dict, patent_index: ChunkIndex | None) -> dict:
+        sub_question, prompt, report = construct_sub_question_prompt(question, patent, patent_index)
+        sub_answer = {'spif': patent['spif'], 'question': sub_question, 'msg': None}
+        async with semaphore:
+            try:
+                sub_answer['msg'] = await asyncio.wait_for(
+                    agenerate_ai_response(prompt, use_cache, fetch_stored_response, store_response,
+                                          route=choose_model_route(question, report['prompt_tokens']),
+                                          deadline=time.monotonic() + compare_timeout_seconds),
+                    compare_timeout_seconds)
+                sub_answer['status'] = 'answered'
+            except asyncio.TimeoutError:
+                logger.warning('Comparison sub-question about %s timed out after %s s', patent['spif'], compare_timeout_seconds)
+                sub_answer['status'] = 'timed_out'
+            except Exception:
+                logger.exception('Comparison sub-question about %s failed', patent['spif'])
+                sub_answer['status'] = 'failed'
+        return sub_answer
+
+    with stage('sub_questions'):
+        sub_answers = await asyncio.gather(*[answer(patent, index) for patent, index in zip(patents, patent_indices or [None] * len(patents))])
+    if not any(sub_answer['status'] == 'answered' for sub_answer in sub_answers):
+        return {'msg': None, 'sub_answers': sub_answers}
+
+    prompt = construct_comparison_prompt(question, sub_answers)
+    with stage('synthesis'):
+        msg = await asyncio.wait_for(
+            agenerate_ai_response(prompt, use_cache, fetch_stored_response, store_response,
+                                  route=choose_model_route(question, count_prompt_tokens(prompt)),
+                                  deadline=time.monotonic() + compare_timeout_seconds),
+            compare_timeout_seconds)
+    return {'msg': msg, 'sub_answers': sub_answers}
+
+
+def get_ai_response_cache_key(chat_prompt: PromptValue, chat: ChatOpenAI) -> str:
+    """Hash of everything that determines the AI response: the rendered prompt messages, the model and its sampling
+    parameters. Only deterministic (temperature 0) responses should be looked up by it.
+    """
+    key_data = {
+        'messages': [[message.type, message.content] for message in get_prompt_messages(chat_prompt)],
+        'model': chat.model_name,
+        'params': {'temperature': chat.temperature, 'max_tokens': chat.max_tokens, 'n': chat.n, **chat.model_kwargs},
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+async def agenerate_on_route(chat_prompt: PromptValue, chat: ChatOpenAI, route_name: str, deadline: float | None) -> tuple[str, ChatOpenAI, LLMResult]:
+    """Generate a response with chat, the model of route_name. If that would leave too little of the latency budget
+    for the fallback route (see get_route_timeout()), it is cancelled, or not started, and the fallback route answers.
+
+    Returns:
+        tuple[str, ChatOpenAI, LLMResult]: The route taken, its chat model and the result.
+    """
+    timeout = get_route_timeout(route_name, deadline)
+    if timeout is None or timeout > 0:
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(chat.agenerate([chat_prompt]), timeout)
+            observe_route_seconds(route_name, time.monotonic() - start)
+            return route_name, chat, result
+        except asyncio.TimeoutError:
+            # The response would have taken at least this long, so the estimate should grow at least that much.
+            observe_route_seconds(route_name, time.monotonic() - start)
+
+    chat = make_route_chat_model(FALLBACK_MODEL_ROUTE)
+    start = time.monotonic()
+    result = await chat.agenerate([chat_prompt])
+    observe_route_seconds(FALLBACK_MODEL_ROUTE, time.monotonic() - start)
+    return FALLBACK_MODEL_ROUTE, chat, result
+
+
+async def agenerate_ai_response(chat_prompt: PromptValue,
+                                use_cache: bool = True,
+                                fetch_stored_response: Callable[[str], Awaitable[str | None]] | None = None,
+                                store_response: Callable[[str, str], Awaitable[None]] | None = None,
+                                route: dict | None = None,
+                                deadline: float | None = None) -> str:
+    """Given a prompt, generate the AI's response. Awaits the OpenAI request instead of blocking the event loop.
+
+    The model runs at temperature 0, so the same prompt gets the same response. Responses are therefore cached in
+    memory by get_ai_response_cache_key(), and in the DB too if persist_ai_responses is set. Concurrent requests for the
+    same uncached prompt share one OpenAI request.
 
     Args:
         chat_prompt (PromptValue): A LangChain prompt, e.g. as returned from ChatPromptTemplate.format_prompt()
+        use_cache (bool, optional): If False, always ask OpenAI, and cache the new response in place of any cached one. Defaults to True.
+        fetch_stored_response (Callable[[str], Awaitable[str | None]] | None, optional): Given a cache key, returns the response stored in the DB or None. Defaults to None.
+        store_response (Callable[[str, str], Awaitable[None]] | None, optional): Stores a response in the DB under a cache key. Defaults to None.
+        route (dict | None, optional): As returned by choose_model_route(). Defaults to None (DEFAULT_MODEL_ROUTE).
+        deadline (float | None, optional): As returned by make_llm_deadline(). Defaults to None (no latency budget).
 
     Returns:
         str: The AI response
     """
 
-    chat = ChatOpenAI(temperature=0)
-    result = chat.generate([chat_prompt])
-    return result.generations[0][0].text
+    route = route or {'route': DEFAULT_MODEL_ROUTE, 'question_type': 'unknown', 'prompt_tokens': None}
+    chat = make_route_chat_model(route['route'])
+    key = get_ai_response_cache_key(chat_prompt, chat)
+    # Set if the fallback route answered instead of the chosen one.
+    fallback_key = None
+
+    async def generate() -> str:
+        nonlocal fallback_key
+        if use_cache:
+            stored_response = await fetch_stored_ai_response(key, fetch_stored_response)
+            if stored_response is not None:
+                return stored_response
+        start = time.monotonic()
+        with stage('llm'):
+            route_taken, llm, result = await agenerate_on_route(chat_prompt, chat, route['route'], deadline)
+        record_model_route(route, route_taken, time.monotonic() - start)
+        response = result.generations[0][0].text
+        # OpenAI reports how many tokens it counted; fall back to counting them here if it didn't.
+        token_usage = (result.llm_output or dict()).get('token_usage', dict())
+        record_llm_tokens(llm.model_name,
+                          token_usage.get('prompt_tokens') or count_prompt_tokens(chat_prompt),
+                          token_usage.get('completion_tokens') or count_tokens(response))
+        if route_taken != route['route']:
+            fallback_key = get_ai_response_cache_key(chat_prompt, llm)
+        await store_ai_response(fallback_key or key, response, store_response)
+        return response
+
+    if use_cache:
+        response = await ai_response_cache.get_or_load(key, generate)
+    else:
+        response = await generate()
+    if fallback_key is not None:
+        # Keep the fallback model's response under its own key, so that the next turn with this prompt asks the chosen model again.
+        ai_response_cache.pop(key)
+        ai_response_cache.put(fallback_key, response)
+    elif not use_cache:
+        ai_response_cache.put(key, response)
+    return response
+
+
+async def astream_ai_response(chat_prompt: PromptValue,
+                              use_cache: bool = True,
+                              fetch_stored_response: Callable[[str], Awaitable[str | None]] | None = None,
+                              store_response: Callable[[str, str], Awaitable[None]] | None = None,
+                              route: dict | None = None,
+                              deadline: float | None = None) -> AsyncIterator[str]:
+    """Given a prompt, yield the AI's response token by token as OpenAI sends them. A cached response (see
+    agenerate_ai_response(), whose arguments this takes too) is yielded whole, and a streamed one is cached once complete.
+    Only the wait for the first token counts against the latency budget: once the chosen route has started answering,
+    its response is streamed to the end rather than replaced by the fallback route's.
+
+    Args:
+        chat_prompt (PromptValue): A LangChain prompt, e.g. as returned from ChatPromptTemplate.format_prompt()
+
+    Yields:
+        str: The next piece of the AI response. Concatenating everything yielded gives the full response.
+    """
+
+    route = route or {'route': DEFAULT_MODEL_ROUTE, 'question_type': 'unknown', 'prompt_tokens': None}
+    route_taken = route['route']
+    chat = make_route_chat_model(route_taken, streaming=True)
+    key = get_ai_response_cache_key(chat_prompt, chat)
+
+    if use_cache:
+        cached_response = ai_response_cache.get(key)
+        if cached_response is not None:
+            ai_response_cache.hits += 1
+            yield cached_response
+            return
+        ai_response_cache.misses += 1
+
+        cached_response = await fetch_stored_ai_response(key, fetch_stored_response)
+        if cached_response is not None:
+            ai_response_cache.put(key, cached_response)
+            yield cached_response
+            return
+
+    tokens = []
+    start = time.monotonic()
+    with stage('llm'):
+        chunks = chat.astream(chat_prompt)
+        timeout = get_route_timeout(route_taken, deadline)
+        timed_out = timeout is not None and timeout <= 0
+        first_chunk = None
+        if not timed_out:
+            try:
+                first_chunk = await asyncio.wait_for(anext(chunks, None), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+        if timed_out:
+            await chunks.aclose()
+            observe_route_seconds(route_taken, time.monotonic() - start)
+            route_taken = FALLBACK_MODEL_ROUTE
+            chat = make_route_chat_model(route_taken, streaming=True)
+            key = get_ai_response_cache_key(chat_prompt, chat)
+            fallback_start = time.monotonic()
+            chunks = chat.astream(chat_prompt)
+            first_chunk = await anext(chunks, None)
+
+        if first_chunk is not None and first_chunk.content:
+            tokens.append(first_chunk.content)
+            yield first_chunk.content
+        async for chunk in chunks:
+            if chunk.content:
+                tokens.append(chunk.content)
+                yield chunk.content
+    observe_route_seconds(route_taken, time.monotonic() - (fallback_start if timed_out else start))
+    record_model_route(route, route_taken, time.monotonic() - start)
+
+    response = ''.join(tokens)
+    # Streamed responses don't come with token usage, so count the tokens here.
+    record_llm_tokens(chat.model_name, count_prompt_tokens(chat_prompt), count_tokens(response))
+    ai_response_cache.put(key, response)
+    await store_ai_response(key, response, store_response)
+
+
+async def fetch_stored_ai_response(key: str, fetch_stored_response: Callable[[str], Awaitable[str | None]] | None) -> str | None:
+    """Look key up with fetch_stored_response if persist_ai_responses is set, counting hits and misses."""
+    if not persist_ai_responses or fetch_stored_response is None:
+        return None
+    stored_response = await fetch_stored_response(key)
+    ai_response_store_stats['hits' if stored_response is not None else 'misses'] += 1
+    return stored_response
+
+
+async def store_ai_response(key: str, response: str, store_response: Callable[[str, str], Awaitable[None]] | None) -> None:
+    if persist_ai_responses and store_response is not None:
+        await store_response(key, response)
+
+
+def get_ai_response_cache_stats() -> dict[str, dict[str, int]]:
+    """Hit and miss counters of the in-memory AI response cache and, behind it, the DB."""
+    return {'memory': ai_response_cache.stats(), 'db': dict(ai_response_store_stats)}
+
+
+# Bump whenever the output of analyze_claims() changes, so that analyses stored on patent documents get recomputed.
+CLAIM_ANALYSIS_VERSION = 3
+# Claim trees rebuilt from stored claim analyses are kept in memory, up to this many.
+CLAIM_TREE_CACHE_MAX_SIZE = 256
+claim_tree_cache = AsyncLRUCache(max_size=CLAIM_TREE_CACHE_MAX_SIZE)
+
+
+def analyze_claims(claims: str) -> dict:
+    """Do the claim analysis that only depends on the patent, so that it can be stored on the patent document
+    once instead of being redone for every prompt.
+
+    Args:
+        claims (str): String of claims, as stored in the `claims` field of a patent document.
+
+    Returns:
+        dict: Dictionary with keys 'version' (CLAIM_ANALYSIS_VERSION), 'claim_tree' (see claims_utils.ClaimTree.to_dict()),
+    'claim_groups' (see ClaimTree.groups()) and 'unique_words' (see get_unique_words_per_word_set()).
+    """
+    claim_tree = ClaimTree.from_claims(claims)
+    # The tree already has each claim's words, so the claims aren't tokenized again for the groups' words.
+    claim_groups, word_sets = claim_tree.groups()
+    return {
+        'version': CLAIM_ANALYSIS_VERSION,
+        'claim_tree': claim_tree.to_dict(),
+        'claim_groups': claim_groups,
+        'unique_words': get_unique_words_per_word_set(word_sets),
+    }
+
+
+def claim_analysis_is_current(patent: dict) -> bool:
+    """Whether patent has a stored claim analysis made by the current version of analyze_claims()."""
+    return patent.get('claim_analysis', dict()).get('version') == CLAIM_ANALYSIS_VERSION
+
+
+def get_claim_analysis(patent: dict) -> dict:
+    """Return the claim analysis stored on the patent document, recomputing it only if it is missing or out of date.
+
+    Args:
+        patent (dict): Patent document
+
+    Returns:
+        dict: See analyze_claims()
+    """
+    if claim_analysis_is_current(patent):
+        return patent['claim_analysis']
+    return analyze_claims(patent['claims'])
+
+
+def get_claim_tree(patent: dict) -> ClaimTree:
+    """Return the patent's claim tree, from memory if it was used recently, otherwise from its claim analysis (see
+    get_claim_analysis()), so that claims are compared without being parsed or tokenized again.
+    """
+    key = (patent['spif'], CLAIM_ANALYSIS_VERSION)
+    claim_tree = claim_tree_cache.get(key)
+    if claim_tree is None:
+        claim_tree = ClaimTree.from_dict(get_claim_analysis(patent)['claim_tree'])
+        claim_tree_cache.put(key, claim_tree)
+    return claim_tree
 
 
 def get_unique_words_per_indep_claim(claims: str) -> dict[str, list[str]]:
     """Identify the independent claims and get the word sets unique to each independent claim and its dependent claims.
 
     Args:
-        claims (str): String of claims; it is assumed that claims are separated by three triple underscores.
+        claims (str): String of claims, as stored in the `claims` field of a patent document.
 
     Returns:
         dict[str, list[str]]: Dictionary whose keys are independent claim numbers and whose values are the words 
     unique to each independent claim and its dependent claims 
     """
 
-    claims_list = claims.split('\n     \n     \n       ')
+    return analyze_claims(claims)['unique_words']
 
-    # Identify which entries of claims_list are independent claims.
-    dep_claim_pattern = 'of\s+claim'
-    indep_claim_indices = [i for i, c in enumerate(claims_list) if re.search(dep_claim_pattern, c) is None]
 
-    # Make a dictionary whose keys are independent claim numbers and whose values are the 1) the text of those independent claims,
-    #  and 2) the text of all dependent claims of each independent claim.
-    indep_claims_and_their_dependents = dict()
-    for i, c in enumerate(claims_list):
-        if i in indep_claim_indices:
-            # Is independent, so start an entry in indep_claims_and_their_dependents.
-            # First numeric appearing in claim should be the claim number.
-            claim_num = re.search('\d+', c).group()
-            assert claim_num is not None, 'Could not find independent claim number.'
-            indep_claims_and_their_dependents[claim_num] = c
-        else:
-            # Is dependent, so group to most recent independent claim since that is what dependent claim refers to.
-            processed_indep_claim_indices = list(indep_claims_and_their_dependents.keys())
-            processed_indep_claim_indices.sort()
-            latest_indep_claim_index = processed_indep_claim_indices[-1]
-            indep_claims_and_their_dependents[latest_indep_claim_index] = indep_claims_and_their_dependents[latest_indep_claim_index] + c
-
-    # Get set of unique words for each independent claim and its dependent claims.
-    word_sets = {ic_num: get_word_set(claims_text) for ic_num, claims_text in indep_claims_and_their_dependents.items()}
-
-    # For each independent claim and its dependents, get list of words that appears only in them.
-    unique_word_lists = dict()
-    for ic_num, word_set in word_sets.items():
-        unique_words = word_set
-        for other_ic_num, other_word_set in word_sets.items():
-            if ic_num == other_ic_num:
-                continue
-            unique_words = unique_words - other_word_set
-        unique_word_lists[ic_num] = list(unique_words)
-
-    return unique_word_lists
-
-
-def get_word_set(multi_word_string: str) -> set:
-    """Split a string into lower cased words with numerics not included and remove punctuation. Then return only the unique words.
+def get_unique_words_per_word_set(word_sets: dict[str, set[str]]) -> dict[str, list[str]]:
+    """Get the words that appear in only one of the word sets.
 
     Args:
-        multi_word_string (str): What it sounds like
+        word_sets (dict[str, set[str]]): Words of each group of claims
 
     Returns:
-        set: Set of unique un-punctuated words
+        dict[str, list[str]]: Dictionary with the same keys as word_sets whose values are the words unique to that set
     """
-    # Assume words are split by spaces.
-    words = multi_word_string.split(' ')
 
-    # Remove punctuation and new-lines.
-    def remove_chars(word: str, chars_to_remove: list):
-        for char in chars_to_remove:
-            word = word.replace(char, '')
-        return word
-    
-    words = [remove_chars(word, ['.', ';', ',', '(', ')', ':', '\n']) for word in words]
+    # Collect the words seen in more than one group in a single pass. The words unique to a group are the rest of its
+    #  words. Whole-set operations keep the per-word work out of Python.
+    seen_words, shared_words = set(), set()
+    for word_set in word_sets.values():
+        shared_words |= seen_words & word_set
+        seen_words |= word_set
 
-    # Get rid of any length-0 or length-1 words (e.g. '', 'a') and any numerics (e.g. '10'). Also lower-case everything.
-    words = [word.lower() for word in words if len(word) > 1 and not word.isnumeric()]
-    
-    # Remove any duplicates by using set().
-    return set(words)
\ No newline at end of file
+    unique_word_lists = {ic_num: list(word_set - shared_words) for ic_num, word_set in word_sets.items()}
+
+    return unique_word_lists
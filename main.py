@@ -1,7 +1,18 @@
-from typing import Annotated
-
-from fastapi import FastAPI, HTTPException, Query, Response, status
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, AsyncIterator
+
+from fastapi import FastAPI, HTTPException, Path, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware  # Cross origin resources sharing
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+import orjson
+from bson.objectid import ObjectId
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
 
 
 from models import (
@@ -10,29 +21,126 @@ from models import (
     UserDataEditsFromClient,
     ProjectDataFromClient,
     ProjectDataToClient, 
+    ProjectSummaryToClient,
+    PatentEntriesFromClient,
+    UserPatentsToClient,
+    ChatPageToClient,
     PatentDataToClient,
+    JobToClient,
+    PatentBatchFromClient,
+    PatentBatchToClient,
+    PatentSearchToClient,
+    ClaimTreeToClient,
+    ClaimDiffToClient,
+    ChatEntry,
     # UserInput,
     ProjectDataEditsFromClient,
-    AiResponse)
+    AiResponse,
+    AiComparisonResponse)
+from config_utils import load_config
 from database import (
+    connect_to_db,
+    ensure_indexes,
+    warm_up_db,
+    close_db,
     fetch_one_user,
     fetch_one_project, 
     fetch_one_patent,
+    search_patents,
+    fetch_project_chat_page,
     create_user,
     create_project,
-    create_patent,
     modify_user,
-    modify_project_chat,
-    modify_project_patents,
-    modify_project)
-from big_query_utils import query_patent
+    modify_project,
+    append_project_chat_msg,
+    append_project_chat_msgs,
+    add_project_patents,
+    remove_project_patents,
+    fetch_or_create_patent,
+    set_patent_claim_analysis,
+    set_patent_description,
+    set_patent_description_error,
+    fetch_patents,
+    create_patents,
+    fetch_patent_index,
+    save_patent_index,
+    save_patent_indices,
+    fetch_ai_response,
+    save_ai_response,
+    patent_cache,
+    DocumentNotFoundError)
+from big_query_utils import configure_big_query, close_client as close_big_query_client, query_patent, query_patents, query_patent_description
+from patent_loader import LOCAL_PATENTS_DIR, read_local_patent
 from llm_utils import (
+    configure_llm,
+    get_tokenizer,
     construct_ai_prompt, 
-    generate_ai_response)
-
-
-
-app = FastAPI()
+    analyze_claims,
+    build_patent_index,
+    get_patent_index,
+    forget_patent_index,
+    claim_analysis_is_current,
+    get_claim_tree,
+    agenerate_ai_response,
+    astream_ai_response,
+    acompare_patents,
+    choose_model_route,
+    make_llm_deadline,
+    get_ai_response_cache_stats,
+    get_model_route_stats)
+from retrieval_utils import ChunkIndex
+from claims_utils import ClaimTree
+from turn_utils import TurnCoordinator
+from job_utils import Job, JobManager, JOB_SUCCEEDED, JOB_FAILED
+from metrics_utils import MetricsMiddleware, render_metrics, record_stage, stage
+
+
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything here happens before the server starts accepting requests, so the first request doesn't pay for it.
+    #  With several workers (see serve.py) it runs in each worker process, so every worker has its own clients and pools.
+    config = load_config()
+    connect_to_db(config)
+    configure_llm(config)
+    configure_big_query(config)
+    ingest_jobs.max_workers = config.get('ingest_max_workers', INGEST_MAX_WORKERS)
+    global local_patents_dir, validate_db_responses
+    local_patents_dir = config.get('local_patents_dir', LOCAL_PATENTS_DIR)
+    validate_db_responses = config.get('validate_db_responses', False)
+    await warm_up_db()
+    await ensure_indexes()
+    # Loading the tokenizer's vocabulary can mean downloading it, so do it off the event loop.
+    await asyncio.to_thread(get_tokenizer)
+    logger.info('Worker process %d is ready', os.getpid())
+    yield
+    ingest_jobs.shutdown()
+    close_big_query_client()
+    close_db()
+
+
+# Patents are ingested by background jobs whose BigQuery queries run on at most this many threads. Can be overridden by
+#  ingest_max_workers in config.yaml.
+INGEST_MAX_WORKERS = 4
+ingest_jobs = JobManager(max_workers=INGEST_MAX_WORKERS)
+# After fetching a patent's description fails, e.g. because BigQuery is unreachable, it is not tried again for this long,
+#  doubling with each failure in a row up to the maximum.
+DESCRIPTION_RETRY_MIN_SECONDS = 60
+DESCRIPTION_RETRY_MAX_SECONDS = 24 * 60 * 60
+# Directory of <SPIF>.json patent files (see patent_loader.py) that is checked before BigQuery. Can be overridden by
+#  local_patents_dir in config.yaml.
+local_patents_dir = LOCAL_PATENTS_DIR
+# If true, documents read from the DB are validated against the endpoint's response_model like client input is, instead
+#  of being encoded directly by document_response(). Can be overridden by validate_db_responses in config.yaml.
+validate_db_responses = False
+
+app = FastAPI(lifespan=lifespan)
+# AI turns, and the chat writes of the frontend, are run one at a time per (project_id, user_id), so that each one sees
+#  the chat the previous one saved.
+chat_turns = TurnCoordinator()
 
 # An "origin" is any combination of URL and port. 
 # Allow resource sharing between React (running on port 3000) and FastAPI (running on some different port)
@@ -50,9 +158,20 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+# Times every request and its stages (see metrics_utils.stage()) for /metrics and the Server-Timing response header.
+app.add_middleware(MetricsMiddleware)
 
 USER_ID_QUERY = Query(max_length=24, min_length=24, regex='^[a-z0-9]+$', description='_id field of entry in `projects` collection of MongoDB')
 PROJECT_ID_QUERY = Query(max_length=24, min_length=24, regex='^[a-z0-9]+$', description='_id field of entry in `users` collection of MongoDB')
+USER_ID_PATH = Path(max_length=24, min_length=24, regex='^[a-z0-9]+$', description='_id field of entry in `users` collection of MongoDB')
+CHAT_PAGE_MAX_LIMIT = 200
+PATENT_SEARCH_MAX_LIMIT = 100
+# Longest a request may wait for a background job to finish before getting the job's status instead.
+JOB_MAX_WAIT_SECONDS = 60
+JOB_WAIT_QUERY = Query(ge=0, le=JOB_MAX_WAIT_SECONDS, description='Seconds to wait for the job to finish before returning its status')
+# Header of /api/ai responses holding the milliseconds the turn waited for the user's earlier turns in the project to finish.
+QUEUE_WAIT_HEADER = 'X-Queue-Wait-Ms'
+USE_CACHE_QUERY = Query(description='If false, generate a fresh AI response even if the same prompt was answered before')
 
 def reformat_mongodb_id_field(response: dict) -> dict:
     """
@@ -66,6 +185,55 @@ def reformat_mongodb_id_field(response: dict) -> dict:
         response['mongo_id'] = str(response.pop('_id'))
     return response
 
+
+def encode_bson_value(value):
+    """Encode the BSON types that orjson does not know, for MongoJSONResponse."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f'Type is not JSON serializable: {type(value).__name__}')
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """JSON response encoded by orjson, which also turns any ObjectId into its string representation."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=encode_bson_value, option=orjson.OPT_NON_STR_KEYS)
+
+
+def document_response(document: dict, response_model: type[BaseModel], status_code: int = status.HTTP_200_OK) -> Response | dict:
+    """Response for a document read from (or just written to) our own DB, so it already has the shape of response_model.
+
+    Validating it against response_model would rebuild a model for every nested entry, e.g. every chat message of a
+    project, and then FastAPI would encode the result again with the standard json module. Instead only the fields of
+    response_model are kept and they are encoded directly. Client input is still validated by the endpoints' parameters.
+
+    Args:
+        document (dict): MongoDB document, or a dict in the same form. Its _id field is renamed (see reformat_mongodb_id_field()).
+        response_model (type[BaseModel]): The endpoint's response_model, whose fields are kept.
+        status_code (int, optional): Must match the endpoint's status_code. Defaults to 200.
+
+    Returns:
+        Response | dict: The encoded response, or the dict for FastAPI to validate if validate_db_responses is set.
+    """
+    document = reformat_mongodb_id_field(document)
+    if validate_db_responses:
+        return document
+    return MongoJSONResponse({name: value for name, value in document.items() if name in response_model.__fields__}, status_code=status_code)
+
+
+@app.exception_handler(DocumentNotFoundError)
+async def document_not_found_handler(request: Request, exc: DocumentNotFoundError):
+    # Collection names are plural (e.g. `projects`), so drop the "s" for the message.
+    return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                        content={'detail': f'There is no {exc.collection_name[:-1]} matching {exc.query}'})
+
+
+@app.exception_handler(DuplicateKeyError)
+async def duplicate_key_handler(request: Request, exc: DuplicateKeyError):
+    # E.g. creating a user with an email address that another user already has.
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT,
+                        content={'detail': f'A document with the same {", ".join((exc.details or {}).get("keyValue", {}).keys()) or "key"} already exists'})
+
 # ==========================================================
 @app.get("/")
 def read_root():
@@ -75,53 +243,303 @@ def read_root():
 @app.get("/api/user/{email}", response_model=UserDataToClient)
 async def get_user_by_email(email: str):
     db_response = await fetch_one_user(email)
-    if db_response:
-        return reformat_mongodb_id_field(db_response)
-    raise HTTPException(404, f"There is no user with email {email}")
+    if db_response is None:
+        raise HTTPException(404, f"There is no user with email {email}")
+    return document_response(db_response, UserDataToClient)
 
 
 @app.get("/api/project/{project_id}", response_model=ProjectDataToClient)
 async def get_project_by_id(project_id: str):
     db_response = await fetch_one_project(project_id)
-    if db_response:
-        return reformat_mongodb_id_field(db_response)
-    raise HTTPException(404, f"There is no project with ID {project_id}")
+    if db_response is None:
+        raise HTTPException(404, f"There is no project with ID {project_id}")
+    return document_response(db_response, ProjectDataToClient)
+
+
+@app.get("/api/project/{project_id}/summary", response_model=ProjectSummaryToClient)
+async def get_project_summary_by_id(project_id: str):
+    """Same as /api/project/{project_id}, but without the chat, which is most of a busy project's size."""
+    db_response = await fetch_one_project(project_id, projection={'chat': 0})
+    if db_response is None:
+        raise HTTPException(404, f"There is no project with ID {project_id}")
+    return document_response(db_response, ProjectSummaryToClient)
+
+
+@app.get("/api/project/{project_id}/chat/{user_id}", response_model=ChatPageToClient)
+async def get_project_chat_page(project_id: str,
+                                user_id: Annotated[str, USER_ID_PATH],
+                                before: Annotated[int | None, Query(ge=1, description='Return messages preceding this index. Defaults to the end of the chat.')] = None,
+                                limit: Annotated[int, Query(ge=1, le=CHAT_PAGE_MAX_LIMIT)] = 50):
+    """Get one page of user_id's chat in the project, newest page first. To page backwards, pass the returned next_before
+    as `before` in the next request.
+    """
+    db_response = await fetch_project_chat_page(project_id, user_id, limit=limit, before=before)
+    if db_response is None:
+        raise HTTPException(404, f"There is no project with ID {project_id}")
+
+    start = db_response['end'] - len(db_response['messages'])
+    return document_response({
+        'messages': db_response['messages'],
+        'start': start,
+        'total': db_response['total'],
+        'next_before': start if start > 0 else None,
+    }, ChatPageToClient)
 
 # ==========================================================
 
 @app.post("/api/user", response_model=UserDataToClient, status_code=status.HTTP_201_CREATED)
 async def post_user(user_entry: UserDataFromClient):
     db_response = await create_user(user_entry.dict())
-    if db_response:
-        return reformat_mongodb_id_field(db_response)
-    raise HTTPException(400, "Something went wrong / bad request")
+    return document_response(db_response, UserDataToClient, status.HTTP_201_CREATED)
 
 
 @app.post("/api/project/", response_model=ProjectDataToClient, status_code=status.HTTP_201_CREATED)
 async def post_project(project_entry: ProjectDataFromClient):
     db_response = await create_project(project_entry.dict())
-    if db_response:
-        return reformat_mongodb_id_field(db_response)
-    raise HTTPException(400, "Something went wrong / bad request")
+    return document_response(db_response, ProjectDataToClient, status.HTTP_201_CREATED)
+
+async def ingest_patent(job: Job) -> dict:
+    """Job that stores the patent with SPIF job.key, reading it from the local patent files or fetching it from BigQuery
+    if it is not in the DB yet, and then starts a follow-up job to fetch its description.
+
+    Raises:
+        LookupError: If neither the local patent files nor BigQuery have the patent.
+    """
+    patent_spif = job.key
+
+    async def fetch_patent_data(patent_spif: str) -> dict | None:
+        # Patent doesn't exist in DB, so look for it in the local patent files and then in BigQuery, on the job pool's
+        #  threads since both block.
+        patent_data = await ingest_jobs.run_in_pool(read_local_patent, patent_spif, local_patents_dir)
+        if patent_data is None:
+            patent_data, found_patent_in_bq = await ingest_jobs.run_in_pool(query_patent, patent_spif)
+            if not found_patent_in_bq:
+                return None
+        # Claim analysis and the retrieval index only depend on the patent, so make them once here rather than on every chat turn.
+        #  Both take long enough on a long patent to hold up other requests, so they run on the pool too.
+        patent_data['claim_analysis'] = await ingest_jobs.run_in_pool(analyze_claims, patent_data['claims'])
+        await save_patent_index(await ingest_jobs.run_in_pool(build_patent_index, patent_data))
+        return patent_data
+
+    # Concurrent requests for the same uncached patent share a single DB lookup, BigQuery query and insert.
+    db_response, created = await fetch_or_create_patent(patent_spif, fetch_patent_data)
+    if not db_response:
+        raise LookupError(f'Patent {patent_spif} not found locally or in BigQuery')
+
+    description_job = submit_patent_description_job(db_response)
+    if description_job is not None:
+        job.follow_up_job_ids.append(description_job.job_id)
+    return {'created': created, 'patent': PatentDataToClient.parse_obj(reformat_mongodb_id_field(db_response.copy())).dict()}
+
+
+async def ingest_patent_description(job: Job) -> dict:
+    """Job that adds the description to the stored patent with SPIF job.key and rebuilds its retrieval index to include it."""
+    patent_spif = job.key
+    # An empty description marks the patent as done, so that BigQuery is not asked again for a description it doesn't have.
+    try:
+        description = await ingest_jobs.run_in_pool(query_patent_description, patent_spif) or ''
+    except Exception as e:
+        # Recorded on the patent so that reads of it don't start a job that would fail again straight away.
+        await set_patent_description_error(patent_spif, repr(e))
+        raise
+    await set_patent_description(patent_spif, description)
+
+    if description:
+        patent = await fetch_one_patent(patent_spif)
+        await save_patent_index(await ingest_jobs.run_in_pool(build_patent_index, patent))
+        forget_patent_index(patent_spif)
+    return {'description_words': len(description.split())}
+
+
+def submit_patent_description_job(patent: dict) -> Job | None:
+    """Start fetching the patent's description in the background, unless it already has one or fetching it failed too
+    recently (see description_retry_is_due()).
+    """
+    if 'description' in patent or not description_retry_is_due(patent):
+        return None
+    return ingest_jobs.submit('patent_description', patent['spif'], ingest_patent_description)
+
 
-@app.post("/api/patent/{patent_spif}", response_model=PatentDataToClient)
-async def post_patent(patent_spif: str, api_response: Response):
-    # First, see if patent already exists in DB.
-    db_response = await fetch_one_patent(patent_spif)
+def description_retry_is_due(patent: dict) -> bool:
+    """Whether the patent's description may be fetched, i.e. the last attempt did not fail or failed long enough ago. The
+    wait starts at DESCRIPTION_RETRY_MIN_SECONDS and doubles with each failure in a row, up to DESCRIPTION_RETRY_MAX_SECONDS.
+    """
+    error = patent.get('description_error')
+    if error is None:
+        return True
+    backoff_seconds = min(DESCRIPTION_RETRY_MIN_SECONDS * 2 ** (error['attempts'] - 1), DESCRIPTION_RETRY_MAX_SECONDS)
+    # MongoDB returns dates without a time zone, in UTC.
+    failed_at = error['failed_at'].replace(tzinfo=error['failed_at'].tzinfo or timezone.utc)
+    return datetime.now(timezone.utc) >= failed_at + timedelta(seconds=backoff_seconds)
+
+
+def job_response(job: Job, api_response: Response) -> dict:
+    """Job status for the client, with a 202 status code and a Location header to poll while the job is unfinished."""
+    if not job.done:
+        api_response.status_code = status.HTTP_202_ACCEPTED
+        api_response.headers['Location'] = f'/api/jobs/{job.job_id}'
+    return job.to_dict()
+
+
+@app.post("/api/patent/{patent_spif}", response_model=PatentDataToClient | JobToClient)
+async def post_patent(patent_spif: str,
+                      api_response: Response,
+                      wait: Annotated[float, JOB_WAIT_QUERY] = 0):
+    """Make sure the patent is in the DB. If it already is, it is returned (200). Otherwise a job reads it from the
+    local patent files or fetches it from BigQuery in the background, and its status is returned (202) for the client
+    to poll at /api/jobs/{job_id}. If the job finishes within `wait` seconds, the patent is returned instead (201), or a
+    404 if neither has it. Either way, the patent's description is fetched by a follow-up job once the rest of the patent is stored.
+    """
+    # Not fetch_one_patent(), which would wait for an ingestion job already loading the patent.
+    db_response = (await fetch_patents([patent_spif])).get(patent_spif)
     if db_response:
-        api_response.status_code = status.HTTP_200_OK
-        return reformat_mongodb_id_field(db_response)
-    else:
-        # Patent doesn't exist, so query BigQuery for it.
-        patent_data, found_patent_in_bq = query_patent(patent_spif)
-        if not found_patent_in_bq:
-            raise HTTPException(404, 'Patent not found in BigQuery')
-        db_response = await create_patent(patent_data)
-        if db_response:
-            api_response.status_code = status.HTTP_201_CREATED
-            return reformat_mongodb_id_field(db_response)
-        raise HTTPException(400, "Something went wrong during patent creation in DB / bad request")
-        
+        submit_patent_description_job(db_response)
+        return document_response(db_response.copy(), PatentDataToClient)
+
+    with stage('ingest_wait'):
+        job = await ingest_jobs.wait(ingest_jobs.submit('patent', patent_spif, ingest_patent), wait)
+    if job.status == JOB_SUCCEEDED:
+        api_response.status_code = status.HTTP_201_CREATED if job.result['created'] else status.HTTP_200_OK
+        return job.result['patent']
+    if job.status == JOB_FAILED and isinstance(job.exception, LookupError):
+        raise HTTPException(404, 'Patent not found locally or in BigQuery')
+    return job_response(job, api_response)
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobToClient)
+async def get_job(job_id: str, api_response: Response, wait: Annotated[float, JOB_WAIT_QUERY] = 0):
+    """Get a background job's status, waiting up to `wait` seconds for it to finish first. The status code is 202 while
+    the job is unfinished and 200 once it has succeeded or failed.
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        # Jobs are kept in the memory of the worker process that started them (see serve.py), so with several workers
+        #  clients can instead poll POST /api/patent/{patent_spif}?wait=..., which any worker can answer.
+        raise HTTPException(404, f"There is no job with ID {job_id} in this worker process")
+    return job_response(await ingest_jobs.wait(job, wait), api_response)
+
+
+@app.get("/api/jobs")
+def get_job_stats():
+    """Number of remembered jobs in each status."""
+    return ingest_jobs.stats()
+
+
+@app.post("/api/patents/batch", response_model=PatentBatchToClient)
+async def post_patents_batch(patent_batch: PatentBatchFromClient):
+    """Make sure every patent in the batch is in the DB. Patents already in the DB are skipped, and the rest are read
+    from the local patent files or else fetched from BigQuery with one query, and stored with one insert. Reports per
+    SPIF whether it already existed, was created, or could not be found. A batch may have at most
+    models.PATENT_BATCH_MAX_SIZE SPIFs.
+    """
+    # Drop duplicate SPIFs while keeping the order they were requested in.
+    spifs = list(dict.fromkeys(patent_batch.spifs))
+
+    existing_patents = await fetch_patents(spifs)
+    spifs_to_query = [spif for spif in spifs if spif not in existing_patents]
+
+    # Reading files and the BigQuery client block, so keep them off the event loop, on the same bounded pool as the ingestion jobs.
+    new_patents = dict()
+    for spif in spifs_to_query:
+        patent_data = await ingest_jobs.run_in_pool(read_local_patent, spif, local_patents_dir)
+        if patent_data is not None:
+            new_patents[spif] = patent_data
+    spifs_to_query = [spif for spif in spifs_to_query if spif not in new_patents]
+    if spifs_to_query:
+        new_patents.update(await ingest_jobs.run_in_pool(query_patents, spifs_to_query))
+
+    # The claim analyses and retrieval indices are CPU bound, so they go on the pool as well, one patent per call.
+    for patent_data in new_patents.values():
+        patent_data['claim_analysis'] = await ingest_jobs.run_in_pool(analyze_claims, patent_data['claims'])
+    await save_patent_indices([await ingest_jobs.run_in_pool(build_patent_index, patent_data) for patent_data in new_patents.values()])
+    created_patents = {p['spif']: p for p in await create_patents(list(new_patents.values()))}
+    for patent in created_patents.values():
+        submit_patent_description_job(patent)
+
+    items = []
+    for spif in spifs:
+        if spif in existing_patents:
+            items.append({'spif': spif, 'status': 'existing', 'mongo_id': str(existing_patents[spif]['_id'])})
+        elif spif in created_patents:
+            items.append({'spif': spif, 'status': 'created', 'mongo_id': str(created_patents[spif]['_id'])})
+        else:
+            items.append({'spif': spif, 'status': 'missing'})
+
+    return {'patents': items}
+
+
+@app.get("/api/patents/cache")
+def get_patent_cache_stats():
+    return patent_cache.stats()
+
+
+@app.get("/api/patents/search", response_model=PatentSearchToClient)
+async def get_patents_search(q: Annotated[str, Query(min_length=1, max_length=500, description='Words to look for in the titles, abstracts and claims of stored patents. Put phrases in double quotes.')],
+                             offset: Annotated[int, Query(ge=0)] = 0,
+                             limit: Annotated[int, Query(ge=1, le=PATENT_SEARCH_MAX_LIMIT)] = 20):
+    """Search the patents already in the DB, best match first, so that finding a known patent by a title phrase or a
+    claim term doesn't need its SPIF or a new BigQuery lookup.
+    """
+    with stage('search'):
+        # One extra result tells whether there is another page.
+        results = await search_patents(q, limit + 1, offset)
+    next_offset = offset + limit if len(results) > limit else None
+    return {'results': results[:limit], 'next_offset': next_offset}
+
+
+async def fetch_claim_tree(patent_spif: str) -> tuple[ClaimTree, dict]:
+    """Claim tree and document of a stored patent, storing its claim analysis first if it is missing or out of date.
+
+    Raises:
+        HTTPException: 404 if the patent is not in the DB.
+    """
+    patent = await fetch_one_patent(patent_spif)
+    if patent is None:
+        raise HTTPException(404, f'Patent {patent_spif} has not been added; POST /api/patent/{patent_spif} first')
+    if not claim_analysis_is_current(patent):
+        with stage('claim_analysis'):
+            claim_analysis = await ingest_jobs.run_in_pool(analyze_claims, patent['claims'])
+            await set_patent_claim_analysis(patent_spif, claim_analysis)
+            patent = {**patent, 'claim_analysis': claim_analysis}
+    with stage('claim_tree'):
+        return get_claim_tree(patent), patent
+
+
+@app.get("/api/patent/{patent_spif}/claims", response_model=ClaimTreeToClient)
+async def get_patent_claims(patent_spif: str,
+                            word: Annotated[str | None, Query(description='Only return the claims containing this word')] = None):
+    """The patent's claims, each with the earlier claims it refers to, the claims that refer to it, and the
+    independent claims it descends from.
+    """
+    claim_tree, patent = await fetch_claim_tree(patent_spif)
+    numbers = claim_tree.claims_with_word(word) if word is not None else [claim['number'] for claim in claim_tree.claims]
+    claims = []
+    for number in numbers:
+        claim = claim_tree.by_number[number]
+        claims.append({
+            'number': number,
+            'text': patent['claims'][claim['start']:claim['end']].strip(),
+            'depends_on': claim['depends_on'],
+            'children': claim_tree.children[number],
+            'independent_claims': claim_tree.roots(number),
+        })
+    return {'spif': patent_spif, 'independent_claims': claim_tree.independent_claims, 'claims': claims}
+
+
+@app.get("/api/patent/{patent_spif}/claims/diff", response_model=ClaimDiffToClient)
+async def get_patent_claims_diff(patent_spif: str,
+                                 a: Annotated[int, Query(ge=1, description='Number of the first claim')],
+                                 b: Annotated[int, Query(ge=1, description='Number of the second claim')],
+                                 inherited: Annotated[bool, Query(description='If true, compare each claim together with the claims it incorporates')] = True):
+    """Which words are only in claim a, only in claim b, or in both, and how the two claims are related. Uses the
+    words of each claim stored with the patent, so no claim text is tokenized.
+    """
+    claim_tree, _ = await fetch_claim_tree(patent_spif)
+    for number in (a, b):
+        if number not in claim_tree:
+            raise HTTPException(404, f'Patent {patent_spif} has no claim {number}')
+    return claim_tree.diff(a, b, inherited)
+
 
 # ==========================================================
 
@@ -130,15 +548,12 @@ async def put_user_modifications(user_id: str, user_entry: UserDataEditsFromClie
 
     user_edits = {k: v for k, v in user_entry.dict().items() if v is not None}
     response = await modify_user(user_id, updated_user=user_edits)
-
-    if response:
-        return reformat_mongodb_id_field(response)
-    
-    raise HTTPException(400, f'Something went wrong modifying user {user_id}.')
+    return document_response(response, UserDataToClient)
 
 
 @app.put("/api/project/{project_id}", response_model=ProjectDataToClient)
-async def put_project_modifications(project_id: str, project_edits: ProjectDataEditsFromClient, user_id: str | None = None):
+async def put_project_modifications(project_id: str, project_edits: ProjectDataEditsFromClient,
+                                    user_id: Annotated[str | None, USER_ID_QUERY] = None):
     """Modify project document in DB corresponding to project_id. If user_id is specified (not None), only apply project_edits
     to the specified user. Otherwise, each field in project_edits will completely replace its corresponding field in the project
     document.
@@ -149,74 +564,51 @@ async def put_project_modifications(project_id: str, project_edits: ProjectDataE
         user_id (str | None, optional): If specified, only data for this user is replaced by project_edits. Defaults to None.
 
     Raises:
-        HTTPException: If the DB request to modify the project fails.
+        HTTPException: If there is no project with ID project_id, or if user_id is specified and the patents or chat
+    edits have no entry for it.
 
     Returns:
         ProjectDataToClient: The project document with _id stringified.
     """
 
     project_edits = {k: v for k, v in project_edits.dict().items() if v is not None}
-
-    def only_edit_field_for_user(field_name: str, user_id: str, existing_project_entry: dict, project_edits: dict) -> dict:
-        """Each project_edits key replaces the *entire* corresponding key's value in the DB. So make sure parts
-        of the field corresponding to other users remain unchanged by adding them in their original state
-        to project_edits.
-
-        Args:
-            field_name (str): Key of DB document to edit (see models.py's ProjectDataEditsFromClient for keys)
-            user_id (str): Mongo DB user document's _id
-            existing_project_entry (dict): Dict representation of Mongo DB document for project
-            project_edits (dict): Dict having key-value pairs for just the fields of the project edited in this request.
-
-        Returns:
-            dict: Version of project_edits containing the new info in project_edits and unedited info for other users on 
-            this project.
-        """
-
-        tmp = dict()
-        if user_id in existing_project_entry[field_name].keys():
-            tmp = {uid: project_edits[field_name][user_id] if uid == user_id 
-                                          else existing_chat
-                                     for uid, existing_chat in existing_project_entry[field_name].items()}
-        else:
-            tmp = existing_project_entry[field_name]
-            tmp[user_id] = project_edits[field_name][user_id]
-
-        project_edits[field_name] = tmp
-        return project_edits
+    if user_id is not None:
+        for field in ('patents', 'chat'):
+            if field in project_edits and user_id not in project_edits[field]:
+                raise HTTPException(400, f"The {field} edits have no entry for user {user_id}")
 
     # Only add patents to the project that don't already exist for user. Also, only modify the part
-    #  of patents corresponding to queried user. Or if user is not in project, add user entry to patents. 
-    existing_project_entry = None
+    #  of patents corresponding to queried user. Or if user is not in project, add user entry to patents.
+    #  Only this user's patents are read, and setting the dotted field `patents.<user_id>` leaves other users' patents untouched.
     if 'patents' in project_edits.keys() and user_id is not None:
-        existing_project_entry = await fetch_one_project(project_id)
-        patents = existing_project_entry['patents']
-        user_patents = patents[user_id]
+        existing_project_entry = await fetch_one_project(project_id, projection={f'patents.{user_id}': 1})
+        if existing_project_entry is None:
+            raise HTTPException(404, f"There is no project with ID {project_id}")
+        user_patents = existing_project_entry.get('patents', dict()).get(user_id, [])
 
+        # See also POST /api/project/{project_id}/patents/{user_id}, which adds patents without reading the project first.
+        existing_patents = {(p['office'], p['number']) for p in user_patents}
         patents_to_add = []
-        for p in project_edits['patents'][user_id]:
-            edit_patent = {'office': p['office'], 'number': p['number']}
-
+        for p in project_edits.pop('patents')[user_id]:
             # Check if patent already exists in user's list of patents.
-            patent_exists = any([p == edit_patent for p in user_patents])
-            if not patent_exists:
-                patents_to_add.append(edit_patent)
+            if (p['office'], p['number']) not in existing_patents:
+                existing_patents.add((p['office'], p['number']))
+                patents_to_add.append({'office': p['office'], 'number': p['number']})
 
-        project_edits['patents'][user_id] = patents_to_add
-        
-        project_edits = only_edit_field_for_user('patents', user_id, existing_project_entry, project_edits)
+        project_edits[f'patents.{user_id}'] = patents_to_add
 
     # Only modify the part of the chat corresponding to queried user. Or if user is not in project, add user entry to chat.
+    #  This is ordered with the user's AI turns, which save messages too (see save_user_chat()).
     if 'chat' in project_edits.keys() and user_id is not None:
-        if existing_project_entry is None:
-            existing_project_entry = await fetch_one_project(project_id)
-
-        project_edits = only_edit_field_for_user('chat', user_id, existing_project_entry, project_edits)
-
-    response = await modify_project(project_id, updated_project=project_edits)
+        await save_user_chat(project_id, user_id, project_edits.pop('chat')[user_id])
 
-    if response:
-        return reformat_mongodb_id_field(response)
+    if project_edits:
+        response = await modify_project(project_id, updated_project=project_edits)
+    else:
+        response = await fetch_one_project(project_id)
+        if response is None:
+            raise HTTPException(404, f"There is no project with ID {project_id}")
+    return document_response(response, ProjectDataToClient)
 
     # # Get the project record that needs to be updated.
     # project_entry = await fetch_one_project(project_id)
@@ -281,48 +673,283 @@ async def put_project_modifications(project_id: str, project_edits: ProjectDataE
 
     # if response:
     #     return reformat_mongodb_id_field(response)
-    
-    raise HTTPException(400, 'Something went wrong.')
+
+
+@app.post("/api/project/{project_id}/patents/{user_id}", response_model=UserPatentsToClient)
+async def post_project_patents(project_id: str, user_id: Annotated[str, USER_ID_PATH], patent_entries: PatentEntriesFromClient):
+    """Add patents to user_id's patents in the project, skipping any the user already has. However many patents are
+    added, this is a single update in which MongoDB detects the duplicates, and other users' patents are left untouched.
+
+    Returns:
+        UserPatentsToClient: All of the user's patents in the project afterwards.
+    """
+    response = await add_project_patents(project_id, user_id, [p.dict() for p in patent_entries.patents])
+    return document_response({'patents': response.get('patents', dict()).get(user_id, [])}, UserPatentsToClient)
+
+
+@app.post("/api/project/{project_id}/patents/{user_id}/remove", response_model=UserPatentsToClient)
+async def post_project_patents_removal(project_id: str, user_id: Annotated[str, USER_ID_PATH], patent_entries: PatentEntriesFromClient):
+    """Remove patents from user_id's patents in the project in a single update. Patents the user does not have are ignored.
+    This is a POST rather than a DELETE because it has a body, which proxies and clients may drop from a DELETE.
+
+    Returns:
+        UserPatentsToClient: All of the user's patents in the project afterwards.
+    """
+    response = await remove_project_patents(project_id, user_id, [p.dict() for p in patent_entries.patents])
+    return document_response({'patents': response.get('patents', dict()).get(user_id, [])}, UserPatentsToClient)
+
+
+@app.post("/api/project/{project_id}/chat", response_model=ChatEntry, status_code=status.HTTP_201_CREATED)
+async def post_project_chat_msg(project_id: str, user_id: Annotated[str, USER_ID_QUERY], chat_msg: ChatEntry):
+    """Append a single message to user_id's chat in the project. Unlike PUTting the whole chat to /api/project/{project_id},
+    the cost of this does not grow with the length of the chat, and concurrent messages are never lost. The append is
+    ordered with the user's AI turns, and a user message that an AI turn already saved (the last user message, followed
+    by nothing but AI messages) is not appended again, e.g. when the request arrives after /api/ai has answered it.
+
+    Returns:
+        ChatEntry: The appended message.
+    """
+    async with chat_turns.turn((project_id, user_id)):
+        if chat_msg.source == 'user':
+            # Only the end of the chat matters, so only that is read.
+            page = await fetch_project_chat_page(project_id, user_id, limit=2)
+            if page is None:
+                raise HTTPException(404, f"There is no project with ID {project_id}")
+            tail = page['messages']
+            if chat_msg.dict() in tail and all(msg['source'] == 'ai' for msg in tail[tail.index(chat_msg.dict()) + 1:]):
+                return chat_msg
+        await append_project_chat_msg(project_id, user_id, chat_msg.dict())
+    return chat_msg
 
 # ==========================================================
-@app.get("/api/ai", response_model=AiResponse)
-async def get_ai_response(project_id: Annotated[str, PROJECT_ID_QUERY], 
-                          user_id: Annotated[str, USER_ID_QUERY],
-                          last_user_chat_msg: str):
+async def prepare_patents_for_prompt(patents: list[dict]) -> list[ChunkIndex]:
+    """Make sure the patents' claim analyses are current, and get their retrieval indices."""
+    for patent in patents:
+        # Patents ingested before the claim analysis was stored, or by an older version of it, get it (re)computed once here,
+        #  on the ingestion pool so that other requests are not held up meanwhile.
+        if not claim_analysis_is_current(patent):
+            with stage('claim_analysis'):
+                claim_analysis = await ingest_jobs.run_in_pool(analyze_claims, patent['claims'])
+                await set_patent_claim_analysis(patent['spif'], claim_analysis)
+
+    # Retrieval indices are normally built at ingest time, so this only loads them (or finds them already in memory).
+    with stage('patent_indices'):
+        return list(await asyncio.gather(*[get_patent_index(patent, fetch_patent_index, save_patent_index) for patent in patents]))
+
 
-    # Get the chat (list of dicts with 'source' and 'msg' keys) for this project and user.
-    project_entry = await fetch_one_project(project_id)
-    chat = project_entry['chat']
-    user_chat = chat[user_id]
+async def prepare_ai_prompt(project_id: str, user_id: str, last_user_chat_msg: str) -> tuple[list[dict], list, bool, dict]:
+    """Fetch the project and patent needed to answer the user's latest chat message and build the LLM prompt from them.
+
+    Args:
+        project_id (str): Mongo DB project document's _id
+        user_id (str): Mongo DB user document's _id
+        last_user_chat_msg (str): The message the user just sent, which the AI should answer.
+
+    Returns:
+        tuple[list[dict], list, bool, dict]: This user's chat list (including last_user_chat_msg), the prompt, whether
+    last_user_chat_msg is already saved at the end of the chat in the DB, and the model route to answer it with.
+    """
+
+    # Get the chat (list of dicts with 'source' and 'msg' keys) and patents for this project and user, but not other users'.
+    with stage('fetch_project'):
+        project_entry = await fetch_one_project(project_id, projection={f'chat.{user_id}': 1, f'patents.{user_id}': 1})
+    if project_entry is None:
+        raise HTTPException(404, f"There is no project with ID {project_id}")
+    user_chat = project_entry.get('chat', dict()).get(user_id, [])
+    user_patents = project_entry.get('patents', dict()).get(user_id, [])
     # Handle case that frontend's request to put last user msg in DB has not completed yet. In that case,
     #  append message from frontend to local copy of the un-updated chat log pulled from the DB.
-    last_msg_in_db  = user_chat[-1]
-    db_is_up_to_date = last_msg_in_db['source'] == 'user' and last_msg_in_db['msg'] == last_user_chat_msg
+    db_is_up_to_date = len(user_chat) > 0 and user_chat[-1]['source'] == 'user' and user_chat[-1]['msg'] == last_user_chat_msg
     if not db_is_up_to_date:
         user_chat.append({'source': 'user', 'msg': last_user_chat_msg})
 
-    # Get the patent (TODO design prompt to allow more than one patent and then fetch all patents whose metadata is in project_entry['patents'][user_id]).
-    if len(project_entry['patents'][user_id]) > 0:
-        patent_metadata = project_entry['patents'][user_id][0]
-        patent_spif = patent_metadata['office'] + patent_metadata['number']
-        patent = await fetch_one_patent(patent_spif)
-    else:
-        patent = "No patent is available"
+    # Get all of the user's patents with one query (or none, if they are all cached).
+    patent_spifs = [p['office'] + p['number'] for p in user_patents]
+    with stage('fetch_patents'):
+        patents_by_spif = await fetch_patents(patent_spifs)
+    patents = [patents_by_spif[spif] for spif in patent_spifs if spif in patents_by_spif]
+    patent_indices = await prepare_patents_for_prompt(patents)
+
+    with stage('construct_prompt'):
+        prompt, prompt_report = construct_ai_prompt(user_chat, patents, patent_indices=patent_indices)
+    logger.info('AI prompt for project %s, user %s: %s', project_id, user_id, prompt_report)
+    return user_chat, prompt, db_is_up_to_date, choose_model_route(last_user_chat_msg, prompt_report['prompt_tokens'])
+
+
+async def save_user_chat(project_id: str, user_id: str, chat: list[dict]) -> None:
+    """Save the chat the frontend sent for user_id in the project without losing messages that AI turns saved. This runs
+    as one of the user's turns (see chat_turns), so it never interleaves with them. The frontend sends its whole copy of
+    the chat, which can be out of date by the time it arrives: if the stored chat already starts with it (e.g. a turn
+    has saved the question and its answer), nothing is written; if it starts with the stored chat, only the messages
+    after that are appended; otherwise (e.g. the chat was cleared) it replaces the stored chat.
+
+    Raises:
+        HTTPException: If there is no project with ID project_id.
+    """
+    async with chat_turns.turn((project_id, user_id)):
+        project_entry = await fetch_one_project(project_id, projection={f'chat.{user_id}': 1})
+        if project_entry is None:
+            raise HTTPException(404, f"There is no project with ID {project_id}")
+        stored_chat = project_entry.get('chat', dict()).get(user_id, [])
+        if chat and stored_chat[:len(chat)] == chat:
+            return
+        if stored_chat and chat[:len(stored_chat)] == stored_chat:
+            await append_project_chat_msgs(project_id, user_id, chat[len(stored_chat):])
+        else:
+            # Setting the dotted field `chat.<user_id>` leaves other users' chats untouched.
+            await modify_project(project_id, {f'chat.{user_id}': chat}, projection={'_id': 1})
 
-    prompt = construct_ai_prompt(user_chat, patent)
-    ai_msg = generate_ai_response(prompt)
 
-    # Put the AI-generated message in the user_chat list, and then make that updated list 
-    #  the entry for this user in the project. Update the DB accordingly.
-    # Yes, I know, this is a GET endpoint, but I am ok updating the DB in it because in 
-    #  PUT and POST typically imply the client is sending data to the backend. Here the
-    #  backend (i.e. the AI) is the one generating the data.
+async def save_ai_msg(project_id: str, user_id: str, user_chat: list[dict], ai_msg: str, user_msg_is_saved: bool = True) -> dict:
+    """Put the AI-generated message in the user_chat list and append it to this user's chat in the DB. If the user's
+    message it answers (the last one in user_chat) did not make it to the DB, it is appended first in the same update,
+    so the chat never holds an answer without its question.
+    """
     new_chat_msg = {'source': 'ai', 'msg': ai_msg}
+    new_chat_msgs = [new_chat_msg] if user_msg_is_saved else [user_chat[-1], new_chat_msg]
     user_chat.append(new_chat_msg)
-    chat[user_id] = user_chat
-    response = await modify_project_chat(project_id, updated_chat=chat)
-    if not response:
-        raise HTTPException(400, 'Something went wrong.')
+    with stage('save_chat'):
+        return await append_project_chat_msgs(project_id, user_id, new_chat_msgs)
+
+
+@app.get("/api/ai", response_model=AiResponse)
+async def get_ai_response(project_id: Annotated[str, PROJECT_ID_QUERY], 
+                          user_id: Annotated[str, USER_ID_QUERY],
+                          last_user_chat_msg: str,
+                          api_response: Response,
+                          use_cache: Annotated[bool, USE_CACHE_QUERY] = True):
+    """Answer last_user_chat_msg and save the answer to the user's chat. Turns for the same project and user run one at
+    a time, and a request repeating the message of a turn that is still running (e.g. a retry) gets that turn's answer
+    rather than starting another. How long the turn waited for earlier ones is in the X-Queue-Wait-Ms header.
+    The model answering is chosen by llm_utils.choose_model_route(), and replaced by a faster one if it is about to use
+    up the request's latency budget, which starts before waiting in the queue.
+    """
+    deadline = make_llm_deadline()
+
+    async def run_turn() -> str:
+        user_chat, prompt, user_msg_is_saved, route = await prepare_ai_prompt(project_id, user_id, last_user_chat_msg)
+        ai_msg = await agenerate_ai_response(prompt, use_cache, fetch_ai_response, save_ai_response, route=route, deadline=deadline)
+
+        # Yes, I know, this is a GET endpoint, but I am ok updating the DB in it because in 
+        #  PUT and POST typically imply the client is sending data to the backend. Here the
+        #  backend (i.e. the AI) is the one generating the data.
+        await save_ai_msg(project_id, user_id, user_chat, ai_msg, user_msg_is_saved)
+        return ai_msg
+
+    ai_msg, queue_wait, coalesced = await chat_turns.run((project_id, user_id), last_user_chat_msg, run_turn)
+    record_stage('queue', queue_wait)
+    if queue_wait or coalesced:
+        logger.info('AI turn for project %s, user %s waited %.3f s in queue (coalesced: %s)', project_id, user_id, queue_wait, coalesced)
+    api_response.headers[QUEUE_WAIT_HEADER] = f'{queue_wait * 1000:.1f}'
 
     data = AiResponse.parse_obj({'msg': ai_msg})
-    return data
\ No newline at end of file
+    return data
+
+
+@app.get("/api/ai/stream")
+async def get_ai_response_stream(project_id: Annotated[str, PROJECT_ID_QUERY], 
+                                 user_id: Annotated[str, USER_ID_QUERY],
+                                 last_user_chat_msg: str,
+                                 use_cache: Annotated[bool, USE_CACHE_QUERY] = True):
+    """Same as /api/ai, but the AI response is sent as Server-Sent Events while it is being generated.
+    A `queued` event whose data is the milliseconds spent waiting for the user's earlier turns comes first.
+    Each `token` event's data is a JSON-encoded string holding the next piece of the response. Once the response is
+    complete and saved to the project chat, a `done` event is sent whose data is the AiResponse JSON. If the project
+    does not exist or disappears before the response can be saved, or generating the response fails, an `error` event
+    is sent instead. A cached response
+    comes in a single `token` event. Streamed turns are serialized with /api/ai's but are never coalesced. Only the
+    time until the first token counts against the latency budget.
+    """
+    deadline = make_llm_deadline()
+
+    async def event_stream() -> AsyncIterator[str]:
+        # The turn only starts once the response does, so errors can only be reported in the stream.
+        async with chat_turns.turn((project_id, user_id)) as queue_wait:
+            record_stage('queue', queue_wait)
+            yield f'event: queued\ndata: {queue_wait * 1000:.1f}\n\n'
+            try:
+                user_chat, prompt, user_msg_is_saved, route = await prepare_ai_prompt(project_id, user_id, last_user_chat_msg)
+            except HTTPException as e:
+                yield f'event: error\ndata: {json.dumps(e.detail)}\n\n'
+                return
+
+            tokens = []
+            try:
+                async for token in astream_ai_response(prompt, use_cache, fetch_ai_response, save_ai_response, route=route, deadline=deadline):
+                    tokens.append(token)
+                    yield f'event: token\ndata: {json.dumps(token)}\n\n'
+            except Exception as e:
+                # The response has already started, so the failure can't be an error status. The partial answer is not saved.
+                logger.exception('Streaming the AI response for project %s, user %s failed', project_id, user_id)
+                yield f'event: error\ndata: {json.dumps(f"Generating the AI response failed: {e}")}\n\n'
+                return
+
+            ai_msg = ''.join(tokens)
+            try:
+                await save_ai_msg(project_id, user_id, user_chat, ai_msg, user_msg_is_saved)
+            except DocumentNotFoundError as e:
+                yield f'event: error\ndata: {json.dumps(str(e))}\n\n'
+                return
+            yield f'event: done\ndata: {AiResponse.parse_obj({"msg": ai_msg}).json()}\n\n'
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.get("/api/ai/compare", response_model=AiComparisonResponse)
+async def get_ai_comparison(project_id: Annotated[str, PROJECT_ID_QUERY],
+                            user_id: Annotated[str, USER_ID_QUERY],
+                            question: str,
+                            spifs: Annotated[list[str] | None, Query(description="SPIFs of the user's patents in the project to compare. Defaults to all of them.")] = None,
+                            use_cache: Annotated[bool, USE_CACHE_QUERY] = True):
+    """Answer a question comparing two or more of the user's patents in the project, e.g. how their claims differ.
+    The question is asked about each patent concurrently (see llm_utils.acompare_patents()) and the answers are combined
+    into one, which is returned along with them. Unlike /api/ai, neither the question nor the answer is added to the chat.
+    """
+    with stage('fetch_project'):
+        project_entry = await fetch_one_project(project_id, projection={f'patents.{user_id}': 1})
+    if project_entry is None:
+        raise HTTPException(404, f"There is no project with ID {project_id}")
+    user_spifs = [p['office'] + p['number'] for p in project_entry.get('patents', dict()).get(user_id, [])]
+    spifs = list(dict.fromkeys(spifs)) if spifs else user_spifs
+    not_in_project = [spif for spif in spifs if spif not in user_spifs]
+    if not_in_project:
+        raise HTTPException(404, f"The user has no patents {', '.join(not_in_project)} in project {project_id}")
+    if len(spifs) < 2:
+        raise HTTPException(400, 'A comparison needs at least two patents')
+
+    with stage('fetch_patents'):
+        patents_by_spif = await fetch_patents(spifs)
+    missing = [spif for spif in spifs if spif not in patents_by_spif]
+    if missing:
+        raise HTTPException(404, f"Patents {', '.join(missing)} have not been fetched yet")
+    patents = [patents_by_spif[spif] for spif in spifs]
+    patent_indices = await prepare_patents_for_prompt(patents)
+
+    try:
+        comparison = await acompare_patents(question, patents, patent_indices, use_cache, fetch_ai_response, save_ai_response)
+    except asyncio.TimeoutError:
+        raise HTTPException(504, 'The answers about each patent could not be combined in time')
+    if comparison['msg'] is None:
+        raise HTTPException(504, 'None of the patents could be asked about in time')
+    return comparison
+
+
+@app.get("/api/ai/cache")
+def get_ai_cache_stats():
+    return get_ai_response_cache_stats()
+
+
+@app.get("/api/ai/routes")
+def get_ai_route_stats():
+    return get_model_route_stats()
+
+
+@app.get("/api/ai/turns")
+def get_ai_turn_stats():
+    return chat_turns.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request latencies, per-stage latencies, MongoDB operation counts and LLM token counts, in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
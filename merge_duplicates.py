@@ -0,0 +1,40 @@
+"""Merge patents stored more than once under the same SPIF, and users with the same email address, and then create the
+unique indexes that ensure_indexes() had to skip because of them.
+
+Before the unique indexes existed, concurrent requests could store the same patent or user twice. The app still starts
+on such a database, but logs the duplicated values and serves without the unique index (see
+database.ensure_unique_index()). Each duplicate is merged into the oldest document with the same key (see
+database.merge_duplicate_patents() and database.merge_duplicate_users()), so rerunning does nothing once they are gone.
+
+Run from the repository root:
+    python -m merge_duplicates
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from config_utils import load_config
+from database import connect_to_db, close_db, ensure_indexes, merge_duplicate_patents, merge_duplicate_users
+
+
+async def merge_duplicates() -> dict[str, int]:
+    """Connect to the DB configured in config.yaml, merge the duplicates and create the indexes."""
+    connect_to_db(load_config())
+    try:
+        counts = {'patents': await merge_duplicate_patents(), 'users': await merge_duplicate_users()}
+        await ensure_indexes()
+        return counts
+    finally:
+        close_db()
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    logging.basicConfig(level=logging.INFO)
+    counts = asyncio.run(merge_duplicates())
+    print(f'Done: {counts["patents"]} duplicate patents and {counts["users"]} duplicate users merged', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
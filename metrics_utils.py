@@ -0,0 +1,239 @@
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+# Upper bounds in seconds of the latency histogram buckets, from a cache hit to a slow LLM response.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Upper bounds of the buckets for the number of MongoDB operations one request makes.
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Collection methods that send an operation to MongoDB and are counted by InstrumentedCollection.
+MONGO_OPERATIONS = frozenset([
+    'find', 'find_one', 'find_one_and_update', 'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one',
+    'delete_one', 'delete_many', 'bulk_write', 'aggregate', 'count_documents', 'create_index',
+])
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Prometheus counter with labels."""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values: dict[tuple[str, ...], float] = dict()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for key, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.label_names, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram with labels and fixed bucket upper bounds."""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # Maps label values to (count in each bucket, not cumulative, with one more for +Inf; sum of observations).
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = dict()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        bucket_counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+        bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for key, (bucket_counts, total) in self._values.items():
+            cumulative = 0
+            for upper_bound, count in zip((*self.buckets, '+Inf'), bucket_counts):
+                cumulative += count
+                upper_bound_label = f'le="{upper_bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, upper_bound_label)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {total[0]}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time from receiving a request to sending the end of its response.', ('method', 'route', 'status'))
+STAGE_DURATION = Histogram('http_request_stage_duration_seconds', 'Time a request spent in each stage of its handling.', ('route', 'stage'))
+REQUEST_MONGO_OPERATIONS = Histogram('http_request_mongo_operations', 'MongoDB operations made per request.', ('route',), COUNT_BUCKETS)
+MONGO_OPERATIONS_TOTAL = Counter('mongo_operations_total', 'MongoDB operations made, by collection and operation.', ('collection', 'operation'))
+LLM_TOKENS_TOTAL = Counter('llm_tokens_total', 'Tokens sent to (prompt) and received from (completion) the LLM.', ('model', 'kind'))
+LLM_ROUTE_DURATION = Histogram('llm_route_duration_seconds', 'Time AI turns took to get their whole response from the LLM, by the type of question, '
+                               'the route chosen for it and the route taken (which differs after falling back).', ('question_type', 'route', 'route_taken'))
+METRICS = (REQUEST_DURATION, STAGE_DURATION, REQUEST_MONGO_OPERATIONS, MONGO_OPERATIONS_TOTAL, LLM_TOKENS_TOTAL, LLM_ROUTE_DURATION)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+class RequestMetrics:
+    """What one request spent its time on, collected while it is handled."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Seconds spent in each named stage, in the order the stages first started. Stages can repeat, e.g. in a loop.
+        self.stages: dict[str, float] = dict()
+        self.mongo_operations = 0
+        self.mongo_seconds = 0.0
+        self.llm_prompt_tokens = 0
+        self.llm_completion_tokens = 0
+        # Route (see llm_utils.choose_model_route()) the request's AI turn took, if it had one.
+        self.llm_route: str | None = None
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header, with durations in milliseconds."""
+        entries = [f'{name};dur={seconds * 1e3:.1f}' for name, seconds in self.stages.items()]
+        if self.mongo_operations:
+            entries.append(f'mongo;dur={self.mongo_seconds * 1e3:.1f};desc="{self.mongo_operations} ops"')
+        if self.llm_prompt_tokens or self.llm_completion_tokens:
+            entries.append(f'llm-tokens;desc="{self.llm_prompt_tokens} prompt, {self.llm_completion_tokens} completion"')
+        if self.llm_route is not None:
+            entries.append(f'llm-route;desc="{self.llm_route}"')
+        entries.append(f'total;dur={(time.perf_counter() - self.start) * 1e3:.1f}')
+        return ', '.join(entries)
+
+
+# Metrics of the request being handled by the current task (or the task that started it), if any.
+current_request_metrics: ContextVar[RequestMetrics | None] = ContextVar('current_request_metrics', default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the body of the `with` block as a stage of the current request. Does nothing outside of a request."""
+    request_metrics = current_request_metrics.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if request_metrics is not None:
+            request_metrics.stages[name] = request_metrics.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Add a stage that was timed elsewhere, e.g. time spent waiting in a queue, to the current request."""
+    request_metrics = current_request_metrics.get()
+    if request_metrics is not None:
+        request_metrics.stages[name] = request_metrics.stages.get(name, 0.0) + seconds
+
+
+def record_llm_tokens(model: str, prompt_tokens: int, completion_tokens: int) -> None:
+    LLM_TOKENS_TOTAL.inc(prompt_tokens, model=model, kind='prompt')
+    LLM_TOKENS_TOTAL.inc(completion_tokens, model=model, kind='completion')
+    request_metrics = current_request_metrics.get()
+    if request_metrics is not None:
+        request_metrics.llm_prompt_tokens += prompt_tokens
+        request_metrics.llm_completion_tokens += completion_tokens
+
+
+def record_llm_route(question_type: str, route: str, route_taken: str, seconds: float) -> None:
+    LLM_ROUTE_DURATION.observe(seconds, question_type=question_type, route=route, route_taken=route_taken)
+    request_metrics = current_request_metrics.get()
+    if request_metrics is not None:
+        request_metrics.llm_route = route if route_taken == route else f'{route} -> {route_taken}'
+
+
+class InstrumentedCollection:
+    """Wraps a Motor collection to count the MongoDB operations made through it, per collection and per request,
+    and time the ones that are awaited. Everything else is passed through to the collection.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._collection, name)
+        if name not in MONGO_OPERATIONS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            MONGO_OPERATIONS_TOTAL.inc(collection=self._collection.name, operation=name)
+            request_metrics = current_request_metrics.get()
+            if request_metrics is not None:
+                request_metrics.mongo_operations += 1
+            result = attribute(*args, **kwargs)
+            # Cursors (from find() and aggregate()) are not awaitable; their time shows up in the enclosing stage instead.
+            if request_metrics is None or not hasattr(result, '__await__'):
+                return result
+            return self._timed(result, request_metrics)
+
+        return counted
+
+    @staticmethod
+    async def _timed(awaitable, request_metrics: RequestMetrics) -> Any:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            request_metrics.mongo_seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """ASGI middleware that collects a RequestMetrics for every HTTP request, sends it as a Server-Timing header and
+    adds it to the Prometheus metrics once the response is complete. For streamed responses, the header only covers
+    what happened before the response started.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # Route path templates by endpoint function, so that e.g. every project shares one /api/project/{project_id} label.
+        self._route_paths: dict[Any, str] = dict()
+
+    def _route_path(self, scope: dict) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint not in self._route_paths:
+            # Unmatched paths share one label, so that requests for made-up URLs cannot create unbounded label values.
+            path = next((route.path for route in scope['app'].routes if getattr(route, 'endpoint', None) is endpoint), 'unmatched')
+            self._route_paths[endpoint] = path
+        return self._route_paths[endpoint]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_metrics = RequestMetrics()
+        token = current_request_metrics.set(request_metrics)
+        status = 500
+
+        async def send_with_server_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message.setdefault('headers', [])
+                message['headers'] = [*message['headers'], (b'server-timing', request_metrics.server_timing().encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            current_request_metrics.reset(token)
+            route = self._route_path(scope)
+            # The /metrics scrapes themselves would only add noise.
+            if route != '/metrics':
+                REQUEST_DURATION.observe(time.perf_counter() - request_metrics.start, method=scope['method'], route=route, status=status)
+                for name, seconds in request_metrics.stages.items():
+                    STAGE_DURATION.observe(seconds, route=route, stage=name)
+                if request_metrics.mongo_operations:
+                    STAGE_DURATION.observe(request_metrics.mongo_seconds, route=route, stage='mongo')
+                REQUEST_MONGO_OPERATIONS.observe(request_metrics.mongo_operations, route=route)
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+# Most SPIFs one POST to /api/patents/batch may ask for. Each missing one is fetched from BigQuery in the request's single query.
+PATENT_BATCH_MAX_SIZE = 100
 
 
 class UserDataFromClient(BaseModel):
@@ -75,6 +78,44 @@ class ProjectDataToClient(BaseModel):
     user_ids: list[str]
     document_ids: list[str]
 
+
+class PatentEntriesFromClient(BaseModel):
+    """
+    Input expected from client for adding patents to or removing patents from one user's patents in a project.
+    """
+    patents: list[PatentEntry]
+
+class UserPatentsToClient(BaseModel):
+    """
+    Return type expected from server after adding or removing patents for one user in a project. Holds all of the user's patents afterwards.
+    """
+    patents: list[PatentEntry]
+
+
+class ProjectSummaryToClient(BaseModel):
+    """
+    Return type expected from server after GETting a project's summary. Same as ProjectDataToClient, but without the chat, so its size
+    does not grow with the length of the conversations.
+    """
+    mongo_id: str
+    name: str
+    patents: dict[str, list[PatentEntry]]
+    user_ids: list[str]
+    document_ids: list[str]
+
+
+class ChatPageToClient(BaseModel):
+    """
+    Return type expected from server after GETting a page of one user's chat in a project. Messages are indexed from 0 (the oldest).
+    """
+    messages: list[ChatEntry]
+    # Index of the first message in messages.
+    start: int
+    # Number of messages in the user's whole chat.
+    total: int
+    # Pass as `before` to get the page of messages preceding this one. None if this page starts at the first message.
+    next_before: int | None
+
 # ==========================================================
 
 class PatentDataToClient(BaseModel):
@@ -84,6 +125,89 @@ class PatentDataToClient(BaseModel):
     abstract: str
     claims: str
 
+class JobToClient(BaseModel):
+    """
+    Return type expected from server for a background job, e.g. ingesting a patent. Poll GET /api/jobs/{job_id} until status is "succeeded" or "failed".
+    """
+    job_id: str
+    # E.g. "patent" or "patent_description"
+    kind: str
+    # E.g. the SPIF of the patent being ingested
+    key: str
+    # "pending", "running", "succeeded" or "failed"
+    status: str
+    result: dict | None = None
+    error: str | None = None
+    # Seconds since the epoch
+    created_at: float
+    finished_at: float | None = None
+    # Jobs started by this one, e.g. fetching the patent's description once the rest of it is stored.
+    follow_up_job_ids: list[str]
+
+
+class PatentBatchFromClient(BaseModel):
+    """
+    Input expected from client for POSTing several patents at once. Larger batches are rejected with 422.
+    """
+    spifs: list[str] = Field(..., max_items=PATENT_BATCH_MAX_SIZE)
+
+class PatentBatchItem(BaseModel):
+    spif: str
+    # "existing" if the patent was already in the DB, "created" if it was read from a local patent file or fetched from BigQuery and stored, "missing" if neither has it.
+    status: str
+    mongo_id: str | None = None
+
+class PatentBatchToClient(BaseModel):
+    """
+    Return type expected from server after POSTing several patents at once. Has one item per distinct requested SPIF.
+    """
+    patents: list[PatentBatchItem]
+
+class PatentSearchResult(BaseModel):
+    spif: str
+    title: str
+    abstract: str
+    # MongoDB's text score; higher is a better match.
+    score: float
+
+class PatentSearchToClient(BaseModel):
+    """
+    Return type expected from server for GET /api/patents/search: one page of matching patents, best match first.
+    """
+    results: list[PatentSearchResult]
+    # Offset of the next page, or None if this is the last one.
+    next_offset: int | None = None
+
+class ClaimToClient(BaseModel):
+    number: int
+    text: str
+    # Numbers of the earlier claims this claim refers to, e.g. [1] for "The razor of claim 1". Empty for independent claims.
+    depends_on: list[int]
+    # Numbers of the claims that refer to this one.
+    children: list[int]
+    # The independent claims this claim is, or descends from.
+    independent_claims: list[int]
+
+class ClaimTreeToClient(BaseModel):
+    """
+    Return type expected from server for GET /api/patent/{patent_spif}/claims: the patent's claims with how they depend on each other.
+    """
+    spif: str
+    independent_claims: list[int]
+    claims: list[ClaimToClient]
+
+class ClaimDiffToClient(BaseModel):
+    """
+    Return type expected from server for GET /api/patent/{patent_spif}/claims/diff: the words of claims a and b compared.
+    """
+    a: int
+    b: int
+    # "same", "a_depends_on_b", "b_depends_on_a", "same_family" (both descend from a common independent claim) or "unrelated"
+    relation: str
+    only_in_a: list[str]
+    only_in_b: list[str]
+    shared: list[str]
+
 # ==========================================================
 
 # class UserInput(BaseModel):
@@ -101,4 +225,20 @@ class AiResponse(BaseModel):
     This is the object FastAPI returns from a /api/ai GET.
     Eventually may add other fields containing links to referenced documents.
     """
-    msg: str
\ No newline at end of file
+    msg: str
+
+class AiSubAnswer(BaseModel):
+    spif: str
+    # The comparison question as asked about this patent alone.
+    question: str
+    # None unless status is "answered".
+    msg: str | None = None
+    # "answered", "timed_out" or "failed"
+    status: str
+
+class AiComparisonResponse(BaseModel):
+    """
+    This is the object FastAPI returns from a /api/ai/compare GET: the combined answer, and the answer about each patent it was combined from.
+    """
+    msg: str
+    sub_answers: list[AiSubAnswer]
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""Load patents from local JSON or JSONL dumps into the `patents` collection, without going through BigQuery.
+
+Each record must have the fields query_patent() returns (spif, title, abstract and claims), and may also have a
+description. A .json file can hold one patent (like notebooks/data/patents/US8205344B2.json), a list of them, or
+several concatenated; a .jsonl file holds one patent per line. Directories are searched for both. Files are read
+incrementally, so memory use does not grow with their size.
+
+Patents are stored in batches keyed by SPIF, replacing the fields of patents already stored, together with their
+claim analysis and retrieval index. With --checkpoint, the number of records done in each file is saved after every
+batch, and a rerun with the same checkpoint skips them.
+
+Run from the repository root:
+    python -m patent_loader notebooks/data/patents --checkpoint load_checkpoint.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+from typing import IO, Iterator
+
+from config_utils import load_config
+from database import connect_to_db, ensure_indexes, close_db, upsert_patents, save_patent_indices
+from llm_utils import analyze_claims, build_patent_index
+
+logger = logging.getLogger(__name__)
+
+# Fields every patent record must have, all strings.
+REQUIRED_PATENT_FIELDS = ('spif', 'title', 'abstract', 'claims')
+# Directory of <SPIF>.json files that the API looks in before querying BigQuery. Can be overridden by local_patents_dir
+#  in config.yaml.
+LOCAL_PATENTS_DIR = 'notebooks/data/patents'
+LOAD_BATCH_SIZE = 500
+# Bytes read from a .json file at a time.
+READ_CHUNK_SIZE = 1 << 16
+
+
+def is_valid_patent(record: object) -> bool:
+    return isinstance(record, dict) and all(isinstance(record.get(field), str) for field in REQUIRED_PATENT_FIELDS)
+
+
+def read_local_patent(patent_spif: str, directory: str = LOCAL_PATENTS_DIR) -> dict | None:
+    """Read <directory>/<patent_spif>.json, e.g. one of the patent files in notebooks/data/patents.
+
+    Returns:
+        dict | None: The patent data, in the same form as query_patent() returns, or None if there is no valid file for the SPIF.
+    """
+    path = Path(directory) / f'{patent_spif}.json'
+    # The SPIF comes from the request path, so make sure it cannot point outside the directory.
+    if path.parent != Path(directory) or not path.is_file():
+        return None
+    with open(path, 'r') as f:
+        record = json.load(f)
+    if not is_valid_patent(record) or record['spif'] != patent_spif:
+        logger.warning('Ignoring %s, which is not a patent with SPIF %s', path, patent_spif)
+        return None
+    return record
+
+
+def iter_json_values(f: IO[str]) -> Iterator[object]:
+    """Yield the values in a file holding a JSON list, or one or more JSON values one after another, without reading
+    the whole file at once.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    at_end = False
+    in_list = None
+
+    while True:
+        buffer = buffer.lstrip()
+        if in_list is None and buffer:
+            in_list = buffer.startswith('[')
+            buffer = buffer[1:] if in_list else buffer
+            continue
+        if in_list:
+            buffer = buffer.lstrip(' \t\r\n,')
+            if buffer.startswith(']'):
+                return
+
+        decoded = False
+        if buffer:
+            try:
+                value, end = decoder.raw_decode(buffer)
+                decoded = True
+            except json.JSONDecodeError:
+                # Most likely the value continues past what has been read so far.
+                if at_end:
+                    raise
+        if decoded:
+            yield value
+            buffer = buffer[end:]
+            continue
+        if at_end:
+            return
+
+        # Read at least as much as is already buffered, so that values much larger than a chunk are not re-parsed too often.
+        chunk = f.read(max(READ_CHUNK_SIZE, len(buffer)))
+        at_end = not chunk
+        buffer += chunk
+
+
+def iter_patent_records(path: Path) -> Iterator[object]:
+    with open(path, 'r') as f:
+        if path.suffix == '.jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_values(f)
+
+
+def find_dump_files(paths: list[str]) -> list[Path]:
+    """The files named in paths, plus the .json and .jsonl files in any directories among them, in a stable order."""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(p for p in path.iterdir() if p.suffix in ('.json', '.jsonl')))
+        else:
+            files.append(path)
+    return files
+
+
+class Checkpoint:
+    """Number of records already loaded from each file, saved to a JSON file so that an interrupted load can resume."""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.records_done: dict[str, int] = dict()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.records_done = json.load(f)
+
+    def get(self, dump_file: Path) -> int:
+        return self.records_done.get(str(dump_file.resolve()), 0)
+
+    def save(self, dump_file: Path, records_done: int) -> None:
+        self.records_done[str(dump_file.resolve())] = records_done
+        if self.path is None:
+            return
+        # Write a temporary file and rename it, so that being interrupted mid-write cannot corrupt the checkpoint.
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.records_done, f)
+        os.replace(temp_path, self.path)
+
+
+async def store_patent_batch(patents: list[dict]) -> int:
+    """Store a batch of patents, which must already have their claim analysis, and their retrieval indices with a bulk
+    write for each.
+
+    Returns:
+        int: Number of patents that were not in the DB before.
+    """
+    await save_patent_indices([build_patent_index(patent) for patent in patents])
+    return await upsert_patents(patents)
+
+
+async def load_patent_dump(dump_file: Path, checkpoint: Checkpoint, batch_size: int = LOAD_BATCH_SIZE) -> dict[str, int]:
+    """Load every patent in dump_file that checkpoint does not mark as done, batch_size at a time.
+
+    Returns:
+        dict[str, int]: Numbers of records read, new patents stored, existing patents updated, and records skipped because they are not valid patents.
+    """
+    counts = {'read': 0, 'new': 0, 'updated': 0, 'skipped': 0}
+    records_done = checkpoint.get(dump_file)
+    if records_done:
+        print(f'{dump_file}: resuming after {records_done} records', file=sys.stderr)
+
+    start = time.perf_counter()
+    records = islice(iter_patent_records(dump_file), records_done, None)
+    while batch := list(islice(records, batch_size)):
+        patents = []
+        for record_num, record in enumerate(batch, start=records_done + 1):
+            # Claims that analyze_claims() cannot parse would also break every chat about the patent, so leave those out too.
+            try:
+                if is_valid_patent(record):
+                    record['claim_analysis'] = analyze_claims(record['claims'])
+                    patents.append(record)
+                    continue
+            except (AttributeError, IndexError, ValueError):
+                pass
+            logger.warning('Skipping record %d of %s, which is not a valid patent', record_num, dump_file)
+            counts['skipped'] += 1
+
+        new = await store_patent_batch(patents)
+        counts['read'] += len(batch)
+        counts['new'] += new
+        counts['updated'] += len(patents) - new
+        records_done += len(batch)
+        checkpoint.save(dump_file, records_done)
+
+        rate = counts['read'] / (time.perf_counter() - start)
+        print(f'{dump_file}: {records_done} records done ({counts["new"]} new, {counts["updated"]} updated, '
+              f'{counts["skipped"]} skipped), {rate:.0f} records/s', file=sys.stderr)
+    return counts
+
+
+async def load_patent_dumps(paths: list[str], checkpoint_path: str | None = None, batch_size: int = LOAD_BATCH_SIZE) -> dict[str, int]:
+    """Connect to the DB configured in config.yaml and load every patent dump found in paths (see find_dump_files())."""
+    connect_to_db(load_config())
+    try:
+        await ensure_indexes()
+        checkpoint = Checkpoint(checkpoint_path)
+        totals = {'read': 0, 'new': 0, 'updated': 0, 'skipped': 0}
+        for dump_file in find_dump_files(paths):
+            for name, count in (await load_patent_dump(dump_file, checkpoint, batch_size)).items():
+                totals[name] += count
+        return totals
+    finally:
+        close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='JSON or JSONL files, or directories of them')
+    parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE, help='Patents stored per bulk write')
+    parser.add_argument('--checkpoint', help='File recording progress, to resume an interrupted load from')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    totals = asyncio.run(load_patent_dumps(args.paths, args.checkpoint, args.batch_size))
+    print(f'Done: {totals["read"]} records read, {totals["new"]} new patents, {totals["updated"]} updated, '
+          f'{totals["skipped"]} skipped', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import math
+import re
+from collections import Counter
+
+# Only lower case letters and digits make up search terms.
+TERM_PATTERN = re.compile(r'[a-z0-9]+')
+# Words too common in patents to say anything about which chunk a question is about.
+STOPWORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have', 'how', 'in', 'is', 'it', 'its', 'of', 'on',
+    'or', 'that', 'the', 'their', 'this', 'to', 'was', 'what', 'when', 'where', 'which', 'with', 'wherein', 'said', 'does', 'do',
+])
+# BM25 parameters: k1 limits how much repeating a term keeps raising a chunk's score, b how much long chunks are penalized.
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def get_terms(text: str) -> list[str]:
+    """Split text into lower cased search terms, leaving out stopwords. Plurals ending in a single "s" are made singular
+    so that e.g. "blades" matches "blade".
+    """
+    terms = [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+    return [term[:-1] if len(term) > 3 and term.endswith('s') and not term.endswith('ss') else term for term in terms]
+
+
+class ChunkIndex:
+    """Term statistics for a list of text chunks, e.g. the parts of one patent. Several indices can be searched together
+    with rank_chunks(), e.g. to answer a question about all of a user's patents at once.
+    """
+
+    def __init__(self, chunks: list[dict], term_counts: list[dict[str, int]]):
+        """
+        Args:
+            chunks (list[dict]): Chunks. Each must have a 'text' key; other keys are kept but not used.
+            term_counts (list[dict[str, int]]): For each chunk, how many times each term appears in it.
+        """
+        self.chunks = chunks
+        self.term_counts = term_counts
+        self.lengths = [sum(counts.values()) for counts in term_counts]
+        # Maps each term to (chunk index, term count) for every chunk it appears in.
+        self.postings: dict[str, list[tuple[int, int]]] = dict()
+        for i, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((i, count))
+
+    @classmethod
+    def from_chunks(cls, chunks: list[dict]) -> 'ChunkIndex':
+        return cls(chunks, [dict(Counter(get_terms(chunk['text']))) for chunk in chunks])
+
+    @classmethod
+    def from_dict(cls, index_dict: dict) -> 'ChunkIndex':
+        """Inverse of to_dict()."""
+        return cls(index_dict['chunks'], index_dict['term_counts'])
+
+    def to_dict(self) -> dict:
+        """Everything needed to rebuild the index without re-tokenizing, in a form that can be stored as JSON or in MongoDB."""
+        return {'chunks': self.chunks, 'term_counts': self.term_counts}
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+
+def rank_chunks(indices: list[ChunkIndex], query: str, top_k: int) -> list[tuple[float, dict]]:
+    """Score every chunk in indices against query with BM25 and return the top_k best. Term rarity is measured across
+    all of indices together, so chunks from different patents are comparable. Ties (including chunks that share no terms
+    with the query) keep the order of indices and of the chunks within them.
+
+    Args:
+        indices (list[ChunkIndex]): Indices to search, e.g. one per patent.
+        query (str): Text to search for, e.g. the lawyer's question.
+        top_k (int): Maximum number of chunks to return.
+
+    Returns:
+        list[tuple[float, dict]]: (score, chunk) pairs, best first.
+    """
+    num_chunks = sum(len(index) for index in indices)
+    if num_chunks == 0 or top_k <= 0:
+        return []
+    avg_length = max(sum(sum(index.lengths) for index in indices) / num_chunks, 1)
+
+    # Scores keyed by (position of index in indices, position of chunk in index).
+    scores = Counter()
+    for term in set(get_terms(query)):
+        doc_freq = sum(len(index.postings.get(term, [])) for index in indices)
+        if doc_freq == 0:
+            continue
+        idf = math.log((num_chunks - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
+        for index_num, index in enumerate(indices):
+            for chunk_num, count in index.postings.get(term, []):
+                length_norm = 1 - BM25_B + BM25_B * index.lengths[chunk_num] / avg_length
+                scores[(index_num, chunk_num)] += idf * count * (BM25_K1 + 1) / (count + BM25_K1 * length_norm)
+
+    all_keys = [(index_num, chunk_num) for index_num, index in enumerate(indices) for chunk_num in range(len(index))]
+    # sorted() is stable, so equal scores keep the order of all_keys.
+    best_keys = sorted(all_keys, key=lambda key: -scores[key])[:top_k]
+    return [(scores[key], indices[key[0]].chunks[key[1]]) for key in best_keys]
@@ -0,0 +1,55 @@
+"""Serve the API with several worker processes, so that throughput scales with the cores of the machine rather than
+being limited to the one core an event loop runs on.
+
+Each worker imports the app and runs its lifespan (see main.lifespan()) on its own, so MongoDB, BigQuery and OpenAI
+clients, connection pools and caches are created per worker once it has started. Nothing is connected at import time,
+which also makes the app safe to preload before forking workers, e.g. with gunicorn's --preload. On SIGTERM or
+Ctrl+C, workers stop accepting connections, get up to --graceful-shutdown-seconds to finish the requests in progress,
+and then close their pools.
+
+State kept in memory is per worker: caches, the order of a user's AI turns (see turn_utils.py), background jobs polled
+at /api/jobs/{job_id}, and the numbers on /metrics.
+
+Run from the repository root:
+    python -m serve --workers 4 --port 8000
+"""
+import argparse
+import logging
+import os
+
+import uvicorn
+
+from config_utils import load_config
+
+# Each can be overridden by the key of the same name, lower cased, in config.yaml, and then by the command line.
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8000
+# Seconds workers wait for requests in progress (e.g. a streamed AI response) before shutting down anyway.
+SERVER_GRACEFUL_SHUTDOWN_SECONDS = 30
+
+
+def default_workers() -> int:
+    """One worker per core this process may run on."""
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=config.get('server_host', SERVER_HOST), help='Address to listen on')
+    parser.add_argument('--port', type=int, default=config.get('server_port', SERVER_PORT), help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=config.get('server_workers', default_workers()),
+                        help='Worker processes. Defaults to server_workers in config.yaml, or else the number of cores.')
+    parser.add_argument('--graceful-shutdown-seconds', type=int,
+                        default=config.get('server_graceful_shutdown_seconds', SERVER_GRACEFUL_SHUTDOWN_SECONDS),
+                        help='Longest workers wait for requests in progress when shutting down')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The app is passed as an import string so that each worker imports it itself.
+    uvicorn.run('main:app', host=args.host, port=args.port, workers=args.workers,
+                timeout_graceful_shutdown=args.graceful_shutdown_seconds)
+
+
+if __name__ == '__main__':
+    main()
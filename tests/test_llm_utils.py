@@ -0,0 +1,63 @@
+"""Run from the repository root:
+    python -m pytest tests
+"""
+import pytest
+
+import llm_utils
+from benchmarks.fakes import make_synthetic_patent
+from benchmarks.prompt_benchmark import make_synthetic_chat
+
+
+class WhitespaceTokenizer:
+    """Stands in for tiktoken, which downloads its encodings on first use, with one token per space separated piece."""
+
+    def encode(self, text: str, disallowed_special=()) -> list[str]:
+        return text.split(' ')
+
+    def decode(self, tokens: list[str]) -> str:
+        return ' '.join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def whitespace_tokenizer(monkeypatch):
+    monkeypatch.setattr(llm_utils, 'get_tokenizer', WhitespaceTokenizer)
+
+
+@pytest.fixture(scope='module')
+def patent() -> dict:
+    patent = make_synthetic_patent('US1234567B2')
+    patent['claim_analysis'] = llm_utils.analyze_claims(patent['claims'])
+    return patent
+
+
+@pytest.mark.parametrize('token_budget', [400, 500, 700, 1000, 1500, 2500, 3500, 8000])
+@pytest.mark.parametrize('num_msgs', [1, 3, 10, 50])
+@pytest.mark.parametrize('with_patent', [True, False])
+def test_prompt_fits_token_budget(patent, token_budget, num_msgs, with_patent):
+    patents = [patent] if with_patent else []
+    messages, report = llm_utils.construct_ai_prompt(make_synthetic_chat(num_msgs), patents, token_budget=token_budget)
+
+    assert report['prompt_tokens'] == llm_utils.count_prompt_tokens(messages)
+    assert report['prompt_tokens'] <= token_budget
+    assert report['chat_messages_included'] + report['chat_messages_omitted'] == num_msgs - 1
+
+
+def test_long_question_is_truncated(patent):
+    chat = make_synthetic_chat(3, words_per_msg=2000)
+    messages, report = llm_utils.construct_ai_prompt(chat, [patent], token_budget=1000)
+
+    assert report['question_truncated']
+    assert report['chat_messages_omitted'] == 2
+    assert report['prompt_tokens'] == llm_utils.count_prompt_tokens(messages) <= 1000
+    assert llm_utils.TRUNCATED_SECTION_SUFFIX in messages[-1].content
+
+
+def test_question_is_kept_when_it_fits(patent):
+    _, report = llm_utils.construct_ai_prompt(make_synthetic_chat(3), [patent], token_budget=1000)
+
+    assert not report['question_truncated']
+
+
+def test_budget_below_instructions_raises(patent):
+    with pytest.raises(ValueError):
+        llm_utils.construct_ai_prompt(make_synthetic_chat(1), [patent], token_budget=100)
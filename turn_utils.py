@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable
+
+
+class TurnCoordinator:
+    """Runs chat turns one at a time per key, e.g. per (project_id, user_id), so that each turn reads the chat as the
+    previous turn left it. A turn for the same key and message as one that is queued or running is not run again;
+    its caller gets the result of the turn already under way (e.g. when the lawyer double-clicks or the client retries).
+
+    Not thread safe; it is meant to be used from the event loop only.
+    """
+
+    def __init__(self):
+        # Keys with a turn queued or running, and how many turns that is, so that idle keys' locks can be dropped.
+        self._locks: dict[Hashable, asyncio.Lock] = dict()
+        self._lock_users: Counter = Counter()
+        # Maps (key, message) to the future that the turn answering that message will resolve with (result, queue wait).
+        self._in_flight: dict[tuple[Hashable, Hashable], asyncio.Future] = dict()
+
+        self.turns = 0
+        self.coalesced = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    @asynccontextmanager
+    async def turn(self, key: Hashable) -> AsyncIterator[float]:
+        """Wait until no other turn for key is running, then run the body of the `async with` as the next one.
+
+        Yields:
+            float: Seconds spent waiting for earlier turns for key to finish.
+        """
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] += 1
+        start = time.perf_counter()
+        try:
+            async with lock:
+                queue_wait = time.perf_counter() - start
+                self.turns += 1
+                self.total_queue_wait += queue_wait
+                self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+                yield queue_wait
+        finally:
+            self._lock_users[key] -= 1
+            if self._lock_users[key] == 0:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    async def run(self, key: Hashable, message: Hashable, run_turn: Callable[[], Awaitable[Any]]) -> tuple[Any, float, bool]:
+        """Await run_turn() once every earlier turn for key has finished, unless a turn for the same key and message is
+        already queued or running, in which case wait for its result instead.
+
+        Args:
+            key (Hashable): Turns with equal keys run one at a time, in the order they were requested.
+            message (Hashable): What the turn answers, e.g. the user's last chat message.
+            run_turn (Callable[[], Awaitable[Any]]): Called with no arguments to run the turn.
+
+        Returns:
+            tuple[Any, float, bool]: What run_turn() returned, the seconds the turn waited for earlier turns, and whether
+        this call shared another call's turn rather than running its own.
+        """
+        while True:
+            in_flight = self._in_flight.get((key, message))
+            if in_flight is None:
+                break
+
+            self.coalesced += 1
+            try:
+                # Shield so that a follower being cancelled does not cancel the turn everyone else is waiting on.
+                result, queue_wait = await asyncio.shield(in_flight)
+                return result, queue_wait, True
+            except asyncio.CancelledError:
+                # If the caller running the turn was cancelled (rather than this one), run the turn ourselves.
+                if not in_flight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[(key, message)] = future
+        try:
+            async with self.turn(key) as queue_wait:
+                result = await run_turn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved so asyncio does not log it when nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result((result, queue_wait))
+            return result, queue_wait, False
+        finally:
+            del self._in_flight[(key, message)]
+
+    def stats(self) -> dict[str, float]:
+        """Counters describing the turns run since the coordinator was created."""
+        return {
+            'active_keys': len(self._locks),
+            'turns': self.turns,
+            'coalesced': self.coalesced,
+            'mean_queue_wait_seconds': self.total_queue_wait / self.turns if self.turns else 0.0,
+            'max_queue_wait_seconds': self.max_queue_wait,
+        }